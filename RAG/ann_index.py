@@ -0,0 +1,166 @@
+import math
+import time
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+AUTO_FLAT_MAX = 20000
+AUTO_HNSW_MAX = 500000
+ANN_TRAIN_SIZE = 50000
+
+DEFAULT_NPROBE = 16
+DEFAULT_EF_SEARCH = 64
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+PQ_BITS = 8
+
+
+def needs_training(index_type):
+    return index_type in ("auto", "ivf_flat", "ivf_pq")
+
+
+def choose_index_type(num_vectors):
+    if num_vectors < AUTO_FLAT_MAX:
+        return "flat"
+    if num_vectors < AUTO_HNSW_MAX:
+        return "hnsw"
+    return "ivf_pq"
+
+
+def _nlist(num_vectors):
+    # ~4 * sqrt(n) lists, but keep at least 39 training points per centroid
+    return max(1, min(int(4 * math.sqrt(num_vectors)), num_vectors // 39))
+
+
+def default_pq_m(dim):
+    for m in (dim // 8, dim // 4, dim // 2, 1):
+        if m >= 1 and dim % m == 0:
+            return m
+    return 1
+
+
+def pq_bits(num_vectors):
+    # 2**bits centroids per sub-quantizer; small corpora get fewer so k-means has enough points
+    # (0 means the corpus size is not known yet)
+    if num_vectors <= 0:
+        return PQ_BITS
+    return max(1, min(PQ_BITS, int(math.log2(num_vectors)))) if num_vectors > 1 else 1
+
+
+def make_ann_index(dim, index_type = "flat", num_vectors = 0, nlist = None, pq_m = None,
+                   hnsw_m = HNSW_M, ef_construction = HNSW_EF_CONSTRUCTION,
+                   nprobe = DEFAULT_NPROBE, ef_search = DEFAULT_EF_SEARCH):
+    if index_type == "auto":
+        index_type = choose_index_type(num_vectors)
+    if index_type == "ivf_pq" and num_vectors == 1:
+        # PQ training needs two points, and a single vector is searched exactly anyway
+        index_type = "flat"
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {index_type!r}, expected one of {INDEX_TYPES + ('auto',)}")
+
+    if index_type == "flat":
+        return faiss.IndexFlatL2(dim)
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, hnsw_m)
+        index.hnsw.efConstruction = ef_construction
+    else:
+        quantizer = faiss.IndexFlatL2(dim)
+        nlist = nlist or _nlist(num_vectors)
+        if index_type == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_L2)
+        else:
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m or default_pq_m(dim), pq_bits(num_vectors))
+    set_search_params(index, nprobe=nprobe, ef_search=ef_search)
+    return index
+
+
+def set_search_params(index, nprobe = None, ef_search = None):
+    if nprobe is not None:
+        ivf = faiss.try_extract_index_ivf(index)
+        if ivf is not None:
+            ivf.nprobe = min(nprobe, ivf.nlist)
+    if ef_search is not None and hasattr(index, "hnsw"):
+        index.hnsw.efSearch = ef_search
+    return index
+
+
+def _timed_search(index, queries, k):
+    latencies = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        _, ids = index.search(query.reshape(1, -1), k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append(ids[0])
+    return np.array(results), np.array(latencies)
+
+
+def evaluate_index_configs(vectors, queries, configs, k = 10):
+    # recall@k of each config against exact flat search, plus per-query latency
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    dim = vectors.shape[1]
+
+    baseline = faiss.IndexFlatL2(dim)
+    baseline.add(vectors)
+    truth, baseline_latency = _timed_search(baseline, queries, k)
+
+    report = [{
+        "config": {"index_type": "flat"},
+        "recall": 1.0,
+        "latency_ms_p50": float(np.percentile(baseline_latency, 50)),
+        "latency_ms_p95": float(np.percentile(baseline_latency, 95)),
+        "build_s": 0.0,
+    }]
+    for config in configs:
+        config = dict(config)
+        start = time.perf_counter()
+        index = make_ann_index(dim, num_vectors=len(vectors), **config)
+        if not index.is_trained:
+            index.train(vectors[:ANN_TRAIN_SIZE])
+        index.add(vectors)
+        build_s = time.perf_counter() - start
+
+        found, latency = _timed_search(index, queries, k)
+        hits = sum(len(set(row[row >= 0]) & set(exact)) for row, exact in zip(found, truth))
+        report.append({
+            "config": config,
+            "recall": hits / float(truth.size),
+            "latency_ms_p50": float(np.percentile(latency, 50)),
+            "latency_ms_p95": float(np.percentile(latency, 95)),
+            "build_s": build_s,
+        })
+    return report
+
+
+def evaluate_vector_store(vector_store, configs, num_queries = 200, k = 10, seed = 0):
+    # uses stored vectors as both the corpus and (a sample of) the queries
+    index = vector_store.index
+    vectors = index.reconstruct_n(0, index.ntotal)
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(len(vectors), size=min(num_queries, len(vectors)), replace=False)
+    return evaluate_index_configs(vectors, vectors[sample], configs, k=k)
+
+
+def print_report(report):
+    print(f"{'config':<60} {'recall':>8} {'p50 ms':>8} {'p95 ms':>8} {'build s':>8}")
+    for row in report:
+        print(f"{str(row['config']):<60} {row['recall']:>8.3f} {row['latency_ms_p50']:>8.3f} "
+              f"{row['latency_ms_p95']:>8.3f} {row['build_s']:>8.2f}")
+
+
+if __name__ == "__main__":
+    from langchain_huggingface import HuggingFaceEmbeddings
+    from RAG.rag_utils import load_chunk_pdfs
+
+    embedding_model = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+    vector_store = load_chunk_pdfs(embedding_model)
+    configs = [
+        {"index_type": "hnsw", "ef_search": 16},
+        {"index_type": "hnsw", "ef_search": 64},
+        {"index_type": "ivf_flat", "nprobe": 4},
+        {"index_type": "ivf_flat", "nprobe": 16},
+        {"index_type": "ivf_pq", "nprobe": 16},
+    ]
+    print_report(evaluate_vector_store(vector_store, configs))
@@ -0,0 +1,204 @@
+import json
+import os
+import shutil
+
+import numpy as np
+from langchain_community.docstore.base import Docstore
+from langchain_core.documents import Document
+
+TEXTS_FILE = "texts.bin"
+OFFSETS_FILE = "offsets.npy"
+PAGES_FILE = "pages.npy"
+DOCUMENTS_FILE = "documents.npy"
+METADATA_FILE = "metadata.npy"
+EMBEDDINGS_FILE = "embeddings.f32"
+META_FILE = "meta.json"
+EXPORT_BATCH_SIZE = 4096
+# metadata with a column of its own; anything else a chunk carries (total_pages, ...) is kept
+# as a table of distinct values plus one row number per chunk
+COLUMN_FIELDS = ("source", "doc_id", "page")
+
+
+class ChunkStoreWriter:
+    # Appends chunks column by column as ingestion produces them; row i matches FAISS row i.
+    def __init__(self, path):
+        self.path = path
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+        self._texts = open(os.path.join(path, TEXTS_FILE), "wb")
+        self._embeddings = open(os.path.join(path, EMBEDDINGS_FILE), "wb")
+        self._offsets = [0]
+        self._pages = []
+        self._doc_rows = []
+        self._documents = {}
+        self._docstore_ids = []
+        self._metadata_rows = []
+        self._metadata = {}
+        self._dim = None
+
+    def append(self, chunks, vectors, docstore_ids):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self._dim = vectors.shape[1]
+        self._embeddings.write(vectors.tobytes())
+        for chunk, docstore_id in zip(chunks, docstore_ids):
+            data = chunk.page_content.encode("utf-8")
+            self._texts.write(data)
+            self._offsets.append(self._offsets[-1] + len(data))
+            self._pages.append(chunk.metadata.get("page", -1))
+            doc_key = (chunk.metadata.get("doc_id"), chunk.metadata.get("source"))
+            self._doc_rows.append(self._documents.setdefault(doc_key, len(self._documents)))
+            extra = json.dumps({key: value for key, value in chunk.metadata.items() if key not in COLUMN_FIELDS}, sort_keys=True)
+            self._metadata_rows.append(self._metadata.setdefault(extra, len(self._metadata)))
+            self._docstore_ids.append(docstore_id)
+
+    def close(self):
+        self._texts.close()
+        self._embeddings.close()
+        np.save(os.path.join(self.path, OFFSETS_FILE), np.array(self._offsets, dtype=np.int64))
+        np.save(os.path.join(self.path, PAGES_FILE), np.array(self._pages, dtype=np.int32))
+        np.save(os.path.join(self.path, DOCUMENTS_FILE), np.array(self._doc_rows, dtype=np.int32))
+        np.save(os.path.join(self.path, METADATA_FILE), np.array(self._metadata_rows, dtype=np.int32))
+        documents = [{"doc_id": doc_id, "source": source} for doc_id, source in sorted(self._documents, key=self._documents.get)]
+        metadata = [json.loads(extra) for extra in sorted(self._metadata, key=self._metadata.get)]
+        with open(os.path.join(self.path, META_FILE), "w") as f:
+            json.dump({"count": len(self._docstore_ids), "dim": self._dim, "documents": documents,
+                       "metadata": metadata, "docstore_ids": self._docstore_ids}, f)
+        return ChunkStore(self.path)
+
+
+class ChunkStore:
+    # Read-only, memory-mapped columns: texts as one utf-8 blob plus offsets, page and document
+    # per row, and the raw float32 embedding matrix. Nothing is materialised until asked for.
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META_FILE)) as f:
+            meta = json.load(f)
+        self.documents = meta["documents"]
+        self.docstore_ids = meta["docstore_ids"]
+        self.dim = meta["dim"]
+        self.offsets = np.load(os.path.join(path, OFFSETS_FILE), mmap_mode="r")
+        self.pages = np.load(os.path.join(path, PAGES_FILE), mmap_mode="r")
+        self.document_rows = np.load(os.path.join(path, DOCUMENTS_FILE), mmap_mode="r")
+        # stores written before the metadata column only have the column fields
+        self.extra_metadata = meta.get("metadata", [])
+        metadata_path = os.path.join(path, METADATA_FILE)
+        self.metadata_rows = np.load(metadata_path, mmap_mode="r") if os.path.exists(metadata_path) else None
+        count = meta["count"]
+        texts_path = os.path.join(path, TEXTS_FILE)
+        self._texts = np.memmap(texts_path, dtype=np.uint8, mode="r") if os.path.getsize(texts_path) else np.zeros(0, dtype=np.uint8)
+        embeddings_path = os.path.join(path, EMBEDDINGS_FILE)
+        if count and self.dim:
+            self.embeddings = np.memmap(embeddings_path, dtype=np.float32, mode="r", shape=(count, self.dim))
+        else:
+            self.embeddings = np.zeros((0, self.dim or 0), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.docstore_ids)
+
+    def text(self, row):
+        return self._texts[self.offsets[row]:self.offsets[row + 1]].tobytes().decode("utf-8")
+
+    def metadata(self, row):
+        document = self.documents[self.document_rows[row]]
+        metadata = {"source": document["source"], "doc_id": document["doc_id"]}
+        if self.pages[row] >= 0:
+            metadata["page"] = int(self.pages[row])
+        if self.metadata_rows is not None:
+            metadata.update(self.extra_metadata[self.metadata_rows[row]])
+        return metadata
+
+    def document(self, row):
+        return Document(id=self.docstore_ids[row], page_content=self.text(row), metadata=self.metadata(row))
+
+    def rows(self, doc_id = None, pages = None):
+        # row numbers matching a document and/or a page range, computed on the mmapped columns
+        mask = np.ones(len(self), dtype=bool)
+        if doc_id is not None:
+            matches = [i for i, document in enumerate(self.documents) if document["doc_id"] == doc_id]
+            mask &= np.isin(self.document_rows, matches)
+        if pages is not None:
+            pages = range(pages, pages + 1) if isinstance(pages, int) else pages
+            mask &= (self.pages >= pages.start) & (self.pages < pages.stop)
+        return np.flatnonzero(mask)
+
+    def iter_batches(self, batch_size = EXPORT_BATCH_SIZE, doc_id = None, pages = None, with_embeddings = False):
+        # yields column batches (dict of lists / arrays) without building Document objects
+        rows = np.arange(len(self)) if doc_id is None and pages is None else self.rows(doc_id, pages)
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            columns = {
+                "row": batch,
+                "docstore_id": [self.docstore_ids[row] for row in batch],
+                "doc_id": [self.documents[self.document_rows[row]]["doc_id"] for row in batch],
+                "source": [self.documents[self.document_rows[row]]["source"] for row in batch],
+                "page": np.asarray(self.pages[batch]),
+                "text": [self.text(row) for row in batch],
+            }
+            if with_embeddings:
+                columns["embedding"] = np.asarray(self.embeddings[batch])
+            yield columns
+
+    def iter_documents(self, doc_id = None, pages = None):
+        rows = range(len(self)) if doc_id is None and pages is None else self.rows(doc_id, pages)
+        for row in rows:
+            yield self.document(row)
+
+    def export(self, path, format = "jsonl", doc_id = None, pages = None):
+        if format == "jsonl":
+            with open(path, "w", encoding="utf-8") as f:
+                for batch in self.iter_batches(doc_id=doc_id, pages=pages):
+                    for i in range(len(batch["row"])):
+                        f.write(json.dumps({key: (values[i].item() if isinstance(values[i], np.generic) else values[i])
+                                            for key, values in batch.items()}) + "\n")
+        elif format == "parquet":
+            try:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+            except ImportError:
+                raise ImportError("parquet export needs pyarrow (pip install pyarrow)")
+            writer = None
+            for batch in self.iter_batches(doc_id=doc_id, pages=pages):
+                table = pa.table(batch)
+                if writer is None:
+                    writer = pq.ParquetWriter(path, table.schema)
+                writer.write_table(table)
+            if writer is not None:
+                writer.close()
+        else:
+            raise ValueError(f"Unknown export format {format!r}, expected 'jsonl' or 'parquet'")
+        return path
+
+
+class ChunkStoreDocstore(Docstore):
+    # Read-only docstore over a chunk store: a lookup decodes the chunk from the memory-mapped
+    # columns, so the text of a loaded index stays on disk instead of in Python objects.
+    def __init__(self, chunk_store):
+        self.chunk_store = chunk_store
+        self._rows = {docstore_id: row for row, docstore_id in enumerate(chunk_store.docstore_ids)}
+
+    def search(self, search):
+        row = self._rows.get(search)
+        if row is None:
+            # same contract as InMemoryDocstore
+            return f"ID {search} not found."
+        return self.chunk_store.document(row)
+
+    def delete(self, ids):
+        raise ValueError("a memory-mapped index is read-only, rebuild it to remove documents")
+
+    def index_to_docstore_id(self):
+        return dict(enumerate(self.chunk_store.docstore_ids))
+
+
+def write_chunk_store(vector_store, path):
+    # snapshot of an existing store, e.g. after incremental adds; vectors are reconstructed
+    # from the index, which is lossy for quantized index types
+    writer = ChunkStoreWriter(path)
+    rows = sorted(vector_store.index_to_docstore_id)
+    for start in range(0, len(rows), EXPORT_BATCH_SIZE):
+        batch_rows = rows[start:start + EXPORT_BATCH_SIZE]
+        docstore_ids = [vector_store.index_to_docstore_id[row] for row in batch_rows]
+        chunks = [vector_store.docstore.search(docstore_id) for docstore_id in docstore_ids]
+        vectors = vector_store.index.reconstruct_n(batch_rows[0], len(batch_rows))
+        writer.append(chunks, vectors, docstore_ids)
+    return writer.close()
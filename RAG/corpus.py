@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+import pickle
+
+import numpy as np
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from RAG.chunk_store import ChunkStoreDocstore
+from RAG import index_cache
+from RAG.index_cache import DOCUMENTS_DIR, INDEX_CACHE_PATH, file_hash, embedding_model_name
+from RAG.ingest import EMBED_BATCH_SIZE, default_num_workers, embed_batches
+from RAG.lexical import mark_lexical_index_stale
+from RAG.rag_utils import CHUNK_SIZE, CHUNK_OVERLAP, chunk_pdf
+
+EMBEDDING_CACHE_PATH = os.path.join(INDEX_CACHE_PATH, DOCUMENTS_DIR)
+
+
+def list_documents(vector_store):
+    # doc_id -> source path for every document currently in the store
+    if isinstance(vector_store.docstore, ChunkStoreDocstore):
+        # the chunk store keeps a document table, so no chunk has to be decoded
+        return {document["doc_id"]: document["source"] for document in vector_store.docstore.chunk_store.documents}
+    documents = {}
+    for docstore_id in vector_store.index_to_docstore_id.values():
+        chunk = vector_store.docstore.search(docstore_id)
+        if chunk and "doc_id" in chunk.metadata:
+            documents.setdefault(chunk.metadata["doc_id"], chunk.metadata.get("source"))
+    return documents
+
+
+def _chunk_ids(vector_store, doc_id):
+    ids = []
+    for docstore_id in vector_store.index_to_docstore_id.values():
+        chunk = vector_store.docstore.search(docstore_id)
+        if chunk and chunk.metadata.get("doc_id") == doc_id:
+            ids.append(docstore_id)
+    return ids
+
+
+def _embedding_cache_path(doc_id, embedding_model, chunk_size, chunk_overlap):
+    params = json.dumps([embedding_model_name(embedding_model), chunk_size, chunk_overlap])
+    suffix = hashlib.sha256(params.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(EMBEDDING_CACHE_PATH, f"{doc_id}-{suffix}.pkl")
+
+
+def _embed_document(pdf_path, doc_id, embedding_model, chunk_size, chunk_overlap):
+    # embeddings are cached per document, so re-adding a known PDF never re-embeds it; the files
+    # are entries of the index cache and share its size cap and eviction
+    cache_path = _embedding_cache_path(doc_id, embedding_model, chunk_size, chunk_overlap)
+    cache_key = os.path.relpath(cache_path, INDEX_CACHE_PATH)
+    try:
+        with open(cache_path, "rb") as f:
+            chunks, embeddings = pickle.load(f)
+    except FileNotFoundError:
+        pass
+    else:
+        index_cache.touch_entry(cache_key)
+        for chunk in chunks:
+            chunk.metadata["source"] = pdf_path
+        return chunks, embeddings
+
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    chunks = chunk_pdf(pdf_path, text_splitter, doc_id=doc_id)
+    # same batched (and, for large documents, multi-process) embedding as a full build
+    batches = [vectors for _, vectors in embed_batches(chunks, embedding_model, EMBED_BATCH_SIZE, default_num_workers(len(chunks)))]
+    embeddings = np.concatenate(batches) if batches else np.zeros((0, 0), dtype=np.float32)
+
+    os.makedirs(EMBEDDING_CACHE_PATH, exist_ok=True)
+    with open(cache_path + ".tmp", "wb") as f:
+        pickle.dump((chunks, embeddings), f)
+    os.replace(cache_path + ".tmp", cache_path)
+    index_cache.register_entry(cache_key)
+    return chunks, embeddings
+
+
+def _drop_chunk_store(vector_store):
+    # the chunk store is a snapshot of the last full build; after a change readers fall back to
+    # the docstore until chunk_store.write_chunk_store is run again
+    if getattr(vector_store, "chunk_store", None) is not None:
+        vector_store.chunk_store = None
+
+
+def _check_writable(vector_store):
+    # shared indexes are memory-mapped and referenced by other sessions; FAISS would change the
+    # index before the docstore gets a chance to refuse
+    if isinstance(vector_store.docstore, ChunkStoreDocstore):
+        raise ValueError("a memory-mapped index is read-only, add documents to a store from new_vector_store")
+
+
+def add_document(vector_store, pdf_path, chunk_size = CHUNK_SIZE, chunk_overlap = CHUNK_OVERLAP, replace = True):
+    _check_writable(vector_store)
+    doc_id = file_hash(pdf_path)
+    documents = list_documents(vector_store)
+    if doc_id in documents:
+        return doc_id
+
+    if replace:
+        # a new version of an already indexed file replaces the old one
+        for old_doc_id, source in documents.items():
+            if source and os.path.abspath(source) == os.path.abspath(pdf_path):
+                remove_document(vector_store, old_doc_id)
+
+    chunks, embeddings = _embed_document(pdf_path, doc_id, vector_store.embedding_function, chunk_size, chunk_overlap)
+    if chunks:
+        vector_store.add_embeddings(
+            [(chunk.page_content, embedding) for chunk, embedding in zip(chunks, embeddings)],
+            metadatas=[chunk.metadata for chunk in chunks],
+            ids=[chunk.id for chunk in chunks])
+        mark_lexical_index_stale(vector_store)
+        _drop_chunk_store(vector_store)
+    return doc_id
+
+
+def _rebuild_without(vector_store, ids):
+    # HNSW graphs cannot drop vectors in place, so reset the index and re-insert the kept vectors
+    ids = set(ids)
+    index = vector_store.index
+    keep = [row for row, docstore_id in sorted(vector_store.index_to_docstore_id.items()) if docstore_id not in ids]
+    vectors = index.reconstruct_n(0, index.ntotal)[np.array(keep, dtype=np.int64)] if keep else None
+    index.reset()
+    if vectors is not None:
+        index.add(vectors)
+    vector_store.docstore.delete(list(ids))
+    vector_store.index_to_docstore_id = {
+        new_row: vector_store.index_to_docstore_id[row] for new_row, row in enumerate(keep)}
+
+
+def remove_document(vector_store, doc_id):
+    _check_writable(vector_store)
+    ids = _chunk_ids(vector_store, doc_id)
+    if ids:
+        try:
+            vector_store.delete(ids)
+        except RuntimeError:
+            _rebuild_without(vector_store, ids)
+        mark_lexical_index_stale(vector_store)
+        _drop_chunk_store(vector_store)
+    return len(ids)
+
+
+def replace_document(vector_store, doc_id, pdf_path, chunk_size = CHUNK_SIZE, chunk_overlap = CHUNK_OVERLAP):
+    remove_document(vector_store, doc_id)
+    return add_document(vector_store, pdf_path, chunk_size, chunk_overlap, replace=False)
@@ -0,0 +1,221 @@
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+
+import faiss
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+
+from RAG.chunk_store import ChunkStore, ChunkStoreDocstore
+from RAG.lexical import BM25Index, current_lexical_index
+
+INDEX_CACHE_PATH = os.path.abspath("faiss_index")
+INDEX_CACHE_MAX_BYTES = 2 * 1024 ** 3
+MANIFEST_FILE = "manifest.json"
+INDEX_FILE = "index.faiss"
+DOCSTORE_FILE = "index.pkl"
+LEXICAL_FILE = "lexical.npz"
+CHUNKS_DIR = "chunks"
+# per-document embedding caches of RAG.corpus, counted against the same cap
+DOCUMENTS_DIR = "documents"
+STAGING_DIR = "staging"
+
+_manifest_lock = threading.Lock()
+
+
+def file_hash(path, block_size=1 << 20):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def embedding_model_name(embedding_model):
+    return getattr(embedding_model, "model_name", type(embedding_model).__name__)
+
+
+def cache_key(pdf_paths, embedding_model, file_hashes = None, **params):
+    # same bytes + same chunking + same embedder => same index, regardless of file names;
+    # file_hashes skips re-hashing when the caller already has them
+    key = {
+        "files": sorted(file_hashes if file_hashes is not None else (file_hash(path) for path in pdf_paths)),
+        "model": embedding_model_name(embedding_model),
+        "params": params,
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _read_manifest(cache_dir):
+    path = os.path.join(cache_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_manifest(cache_dir, manifest):
+    path = os.path.join(cache_dir, MANIFEST_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+
+def _entry_size(entry_path):
+    if os.path.isfile(entry_path):
+        return os.path.getsize(entry_path)
+    # index entries nest the chunk store (texts and embedding matrix) in a subdirectory
+    return sum(os.path.getsize(os.path.join(root, file)) for root, _, files in os.walk(entry_path) for file in files)
+
+
+def _remove_entry(cache_dir, key):
+    # entries are index directories or single files (document embeddings)
+    path = os.path.join(cache_dir, key)
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def touch_entry(key, cache_dir=INDEX_CACHE_PATH):
+    # marks an entry as used for LRU eviction; key is its path relative to cache_dir
+    with _manifest_lock:
+        manifest = _read_manifest(cache_dir)
+        entry = manifest.setdefault(key, {"size": _entry_size(os.path.join(cache_dir, key)), "created": time.time()})
+        entry["last_access"] = time.time()
+        _write_manifest(cache_dir, manifest)
+
+
+def register_entry(key, cache_dir=INDEX_CACHE_PATH, max_bytes=INDEX_CACHE_MAX_BYTES):
+    # counts a file or directory just written under cache_dir against the cap, evicting others
+    with _manifest_lock:
+        manifest = _read_manifest(cache_dir)
+        now = time.time()
+        manifest[key] = {"size": _entry_size(os.path.join(cache_dir, key)), "created": now, "last_access": now}
+        _evict(cache_dir, manifest, max_bytes, keep=key)
+        _write_manifest(cache_dir, manifest)
+
+
+def _read_index(path):
+    # memory-map where the index type allows it, otherwise fall back to a normal read
+    try:
+        return faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    except RuntimeError:
+        return faiss.read_index(path)
+
+
+def load_cached_index(key, embedding_model, cache_dir=INDEX_CACHE_PATH, read_only=False):
+    # read_only=True memory-maps the index and serves documents straight from the chunk store;
+    # otherwise the store is loaded into memory and behaves like a freshly built one
+    entry_dir = os.path.join(cache_dir, key)
+    index_path = os.path.join(entry_dir, INDEX_FILE)
+    docstore_path = os.path.join(entry_dir, DOCSTORE_FILE)
+    chunks_path = os.path.join(entry_dir, CHUNKS_DIR)
+    if not (os.path.exists(index_path) and (os.path.exists(chunks_path) or os.path.exists(docstore_path))):
+        return None
+
+    index = _read_index(index_path) if read_only else faiss.read_index(index_path)
+    chunk_store = None
+    if os.path.exists(chunks_path):
+        chunk_store = ChunkStore(chunks_path)
+        index_to_docstore_id = dict(enumerate(chunk_store.docstore_ids))
+        if read_only:
+            # documents are read from the memory-mapped chunk store on lookup
+            docstore = ChunkStoreDocstore(chunk_store)
+        else:
+            docstore = InMemoryDocstore({document.id: document for document in chunk_store.iter_documents()})
+    else:
+        with open(docstore_path, "rb") as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+
+    touch_entry(key, cache_dir)
+
+    vector_store = FAISS(
+        embedding_function=embedding_model,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=index_to_docstore_id)
+    lexical_path = os.path.join(entry_dir, LEXICAL_FILE)
+    if os.path.exists(lexical_path):
+        vector_store.lexical_index = BM25Index.load(lexical_path)
+    if chunk_store is not None:
+        vector_store.chunk_store = chunk_store
+    return vector_store
+
+
+def staging_path(key, cache_dir=INDEX_CACHE_PATH):
+    # where a build writes its chunk store before save_index moves it into the entry; unique per
+    # build, so concurrent builds of the same key never write into each other's files
+    staging_dir = os.path.join(cache_dir, STAGING_DIR)
+    os.makedirs(staging_dir, exist_ok=True)
+    return tempfile.mkdtemp(prefix=f"{key}-", dir=staging_dir)
+
+
+def save_index(key, vector_store, cache_dir=INDEX_CACHE_PATH, max_bytes=INDEX_CACHE_MAX_BYTES):
+    entry_dir = os.path.join(cache_dir, key)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=f"{key}.", suffix=".tmp", dir=cache_dir)
+
+    faiss.write_index(vector_store.index, os.path.join(tmp_dir, INDEX_FILE))
+    chunk_store = getattr(vector_store, "chunk_store", None)
+    if chunk_store is None:
+        # without a chunk store the documents have to be pickled
+        with open(os.path.join(tmp_dir, DOCSTORE_FILE), "wb") as f:
+            pickle.dump((vector_store.docstore, vector_store.index_to_docstore_id), f)
+    lexical_index = current_lexical_index(vector_store)
+    if lexical_index is not None:
+        lexical_index.save(os.path.join(tmp_dir, LEXICAL_FILE))
+    if chunk_store is not None:
+        if os.path.abspath(chunk_store.path).startswith(os.path.abspath(entry_dir)):
+            shutil.copytree(chunk_store.path, os.path.join(tmp_dir, CHUNKS_DIR))
+        else:
+            shutil.move(chunk_store.path, os.path.join(tmp_dir, CHUNKS_DIR))
+
+    shutil.rmtree(entry_dir, ignore_errors=True)
+    try:
+        os.replace(tmp_dir, entry_dir)
+    except OSError:
+        # a concurrent build of the same key got there first; its entry holds the same data
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    if chunk_store is not None:
+        vector_store.chunk_store = ChunkStore(os.path.join(entry_dir, CHUNKS_DIR))
+
+    register_entry(key, cache_dir, max_bytes)
+    return entry_dir
+
+
+def _evict(cache_dir, manifest, max_bytes, keep=None):
+    total = sum(entry["size"] for entry in manifest.values())
+    for key in sorted(manifest, key=lambda k: manifest[k].get("last_access", 0)):
+        if total <= max_bytes:
+            break
+        if key == keep:
+            continue
+        total -= manifest[key]["size"]
+        _remove_entry(cache_dir, key)
+        del manifest[key]
+
+
+def invalidate(key=None, cache_dir=INDEX_CACHE_PATH):
+    if not os.path.exists(cache_dir):
+        return
+    with _manifest_lock:
+        manifest = _read_manifest(cache_dir)
+        keys = list(manifest) if key is None else [key]
+        for k in keys:
+            _remove_entry(cache_dir, k)
+            manifest.pop(k, None)
+        if key is None:
+            # including files written before they were tracked in the manifest
+            shutil.rmtree(os.path.join(cache_dir, DOCUMENTS_DIR), ignore_errors=True)
+            shutil.rmtree(os.path.join(cache_dir, STAGING_DIR), ignore_errors=True)
+        _write_manifest(cache_dir, manifest)
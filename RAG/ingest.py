@@ -0,0 +1,199 @@
+import os
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import faiss
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+
+from RAG.ann_index import ANN_TRAIN_SIZE, default_pq_m, make_ann_index, needs_training, pq_bits
+from RAG.chunk_store import ChunkStoreWriter
+from observability import tracing
+
+EMBED_BATCH_SIZE = 64
+PROCESS_POOL_MIN_CHUNKS = 2000
+QUANTIZE_TRAIN_SIZE = 2048
+QUANTIZE_TYPES = {
+    "float16": faiss.ScalarQuantizer.QT_fp16,
+    "int8": faiss.ScalarQuantizer.QT_8bit,
+}
+
+
+def make_index(dim, quantize = None, index_type = "flat", num_vectors = 0, index_params = None):
+    if quantize is None:
+        return make_ann_index(dim, index_type, num_vectors, **(index_params or {}))
+    if quantize not in QUANTIZE_TYPES and quantize != "pq":
+        raise ValueError(f"Unknown quantize type {quantize!r}, expected one of {sorted(QUANTIZE_TYPES) + ['pq']}")
+    if index_type != "flat":
+        raise ValueError("quantize is only supported with index_type='flat', use 'ivf_pq' for compressed ANN search")
+    if quantize == "pq":
+        # exhaustive search over product-quantized codes (48 bytes instead of 1536 for 384-d)
+        return faiss.IndexPQ(dim, default_pq_m(dim), pq_bits(num_vectors), faiss.METRIC_L2)
+    return faiss.IndexScalarQuantizer(dim, QUANTIZE_TYPES[quantize], faiss.METRIC_L2)
+
+
+def new_vector_store(embedding_model, quantize = None, index_type = "flat", num_vectors = 0, index_params = None, dim = None):
+    dim = dim or len(embedding_model.embed_query("test"))
+    index = make_index(dim, quantize, index_type, num_vectors, index_params)
+    return FAISS(
+    embedding_function=embedding_model,
+    index=index,
+    docstore=InMemoryDocstore(),
+    index_to_docstore_id={})
+
+
+def _batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+_worker_model = None
+
+def _init_worker(model_name, model_kwargs, encode_kwargs, num_threads):
+    global _worker_model
+    try:
+        import torch
+        torch.set_num_threads(num_threads)
+    except ImportError:
+        pass
+    from langchain_huggingface import HuggingFaceEmbeddings
+    _worker_model = HuggingFaceEmbeddings(model_name=model_name, model_kwargs=model_kwargs, encode_kwargs=encode_kwargs)
+
+
+def _embed_texts(texts):
+    start = time.perf_counter()
+    vectors = np.asarray(_worker_model.embed_documents(texts), dtype=np.float32)
+    return vectors, time.perf_counter() - start
+
+
+def _traced_vectors(result, size):
+    vectors, seconds = result
+    tracing.record("embed.batch", seconds * 1000, size=size, worker=True)
+    return vectors
+
+
+def embed_batches(chunks, embedding_model, batch_size = EMBED_BATCH_SIZE, num_workers = 1):
+    # yields (chunks, vectors) in input order; chunks may be any iterable, including a generator
+    if num_workers <= 1:
+        for batch in _batches(chunks, batch_size):
+            with tracing.span("embed.batch", size=len(batch)):
+                vectors = embedding_model.embed_documents([chunk.page_content for chunk in batch])
+            yield batch, np.asarray(vectors, dtype=np.float32)
+        return
+
+    initargs = (
+        embedding_model.model_name,
+        getattr(embedding_model, "model_kwargs", {}),
+        getattr(embedding_model, "encode_kwargs", {}),
+        max(1, (os.cpu_count() or 1) // num_workers))
+    with ProcessPoolExecutor(num_workers, initializer=_init_worker, initargs=initargs) as pool:
+        # bounded number of batches in flight keeps memory flat on large corpora
+        pending = deque()
+        for batch in _batches(chunks, batch_size):
+            pending.append((batch, pool.submit(_embed_texts, [chunk.page_content for chunk in batch])))
+            if len(pending) >= 2 * num_workers:
+                done_batch, future = pending.popleft()
+                yield done_batch, _traced_vectors(future.result(), len(done_batch))
+        while pending:
+            done_batch, future = pending.popleft()
+            yield done_batch, _traced_vectors(future.result(), len(done_batch))
+
+
+def print_progress(num_chunks, elapsed):
+    # opt-in progress= callback for scripts; the build itself reports through tracing
+    rate = num_chunks / elapsed if elapsed > 0 else 0.0
+    print(f"Embedded {num_chunks} chunks ({rate:.1f} chunks/sec)")
+
+
+def _insert(vector_store, batch, vectors, chunk_store = None):
+    ids = [chunk.id or str(uuid.uuid4()) for chunk in batch]
+    with tracing.span("faiss.add", rows=len(batch)):
+        vector_store.add_embeddings(
+            [(chunk.page_content, vector) for chunk, vector in zip(batch, vectors)],
+            metadatas=[chunk.metadata for chunk in batch],
+            ids=ids)
+    if chunk_store is not None:
+        chunk_store.append(batch, vectors, ids)
+
+
+def _start_vector_store(embedding_model, pending, num_vectors, quantize, index_type, index_params, chunk_store):
+    dim = pending[0][1].shape[1] if pending else None
+    vector_store = new_vector_store(embedding_model, quantize, index_type, num_vectors, index_params, dim=dim)
+    if pending and not vector_store.index.is_trained:
+        with tracing.span("faiss.train", rows=sum(len(batch) for batch, _ in pending)):
+            vector_store.index.train(np.concatenate([vectors for _, vectors in pending]))
+    for batch, vectors in pending:
+        _insert(vector_store, batch, vectors, chunk_store)
+    return vector_store
+
+
+def default_num_workers(num_chunks):
+    # worker processes only pay off once there is enough to embed
+    use_pool = num_chunks is not None and num_chunks >= PROCESS_POOL_MIN_CHUNKS
+    return (os.cpu_count() or 1) if use_pool else 1
+
+
+def build_vector_store(embedding_model, chunks, batch_size = EMBED_BATCH_SIZE, num_workers = None, quantize = None,
+                       index_type = "flat", index_params = None, num_chunks = None, progress = None,
+                       chunk_store_path = None):
+    if num_chunks is None and hasattr(chunks, "__len__"):
+        num_chunks = len(chunks)
+    if num_workers is None:
+        num_workers = default_num_workers(num_chunks)
+
+    # trained indexes (IVF, int8) and index_type="auto" need a sample of vectors
+    # before the index can be created, so buffer that many first
+    if quantize == "int8":
+        train_size = QUANTIZE_TRAIN_SIZE
+    elif quantize == "pq" or needs_training(index_type):
+        train_size = ANN_TRAIN_SIZE
+    else:
+        train_size = 0
+
+    # the full-precision vectors and chunk columns are also written to a memory-mapped chunk store
+    chunk_store = ChunkStoreWriter(chunk_store_path) if chunk_store_path else None
+    vector_store = None
+    pending = []
+    pending_size = 0
+    done = 0
+    start = time.perf_counter()
+
+    for batch, vectors in embed_batches(chunks, embedding_model, batch_size, num_workers):
+        if vector_store is not None:
+            _insert(vector_store, batch, vectors, chunk_store)
+            done += len(batch)
+        else:
+            pending.append((batch, vectors))
+            pending_size += len(batch)
+            if pending_size < train_size:
+                continue
+            vector_store = _start_vector_store(embedding_model, pending, max(pending_size, num_chunks or 0),
+                                               quantize, index_type, index_params, chunk_store)
+            done += pending_size
+            pending, pending_size = [], 0
+        if progress:
+            progress(done, time.perf_counter() - start)
+
+    if vector_store is None:
+        # corpus smaller than the training sample
+        vector_store = _start_vector_store(embedding_model, pending, pending_size, quantize, index_type, index_params, chunk_store)
+        done += pending_size
+        if progress and done:
+            progress(done, time.perf_counter() - start)
+    # totals go on the caller's span (e.g. index.build); each batch already has an embed.batch span
+    elapsed = time.perf_counter() - start
+    build_span = tracing.current_span()
+    if build_span is not None:
+        build_span.set(embedded_chunks=done, chunks_per_s=round(done / elapsed, 1) if elapsed > 0 else 0.0)
+    if chunk_store is not None:
+        vector_store.chunk_store = chunk_store.close()
+    return vector_store
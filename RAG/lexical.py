@@ -0,0 +1,124 @@
+import json
+import re
+from collections import Counter
+
+import numpy as np
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60
+
+_token = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    return _token.findall(text.lower())
+
+
+class BM25Index:
+    # Inverted index in CSR form with the BM25 weight of every posting precomputed, so a
+    # query is one vectorised scatter-add per query term. Rows refer to docstore ids, not
+    # FAISS rows, so the index stays valid when the vector store deletes and re-packs rows.
+    def __init__(self, vocabulary, offsets, postings, weights, docstore_ids):
+        self.vocabulary = vocabulary
+        self.offsets = offsets
+        self.postings = postings
+        self.weights = weights
+        self.docstore_ids = docstore_ids
+
+    @classmethod
+    def build(cls, texts, docstore_ids, k1 = BM25_K1, b = BM25_B):
+        term_postings = {}
+        lengths = np.zeros(len(texts), dtype=np.float32)
+        for row, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            lengths[row] = sum(counts.values())
+            for term, tf in counts.items():
+                term_postings.setdefault(term, []).append((row, tf))
+
+        num_docs = max(len(texts), 1)
+        avg_length = float(lengths.mean()) if len(texts) else 1.0
+        vocabulary = {}
+        offsets = [0]
+        postings = []
+        weights = []
+        for term_id, (term, entries) in enumerate(term_postings.items()):
+            vocabulary[term] = term_id
+            rows = np.array([row for row, _ in entries], dtype=np.int32)
+            tf = np.array([count for _, count in entries], dtype=np.float32)
+            idf = np.log(1.0 + (num_docs - len(entries) + 0.5) / (len(entries) + 0.5))
+            norm = k1 * (1.0 - b + b * lengths[rows] / (avg_length or 1.0))
+            postings.append(rows)
+            weights.append((idf * tf * (k1 + 1.0) / (tf + norm)).astype(np.float32))
+            offsets.append(offsets[-1] + len(entries))
+
+        return cls(
+            vocabulary,
+            np.array(offsets, dtype=np.int64),
+            np.concatenate(postings) if postings else np.zeros(0, dtype=np.int32),
+            np.concatenate(weights) if weights else np.zeros(0, dtype=np.float32),
+            list(docstore_ids))
+
+    def __len__(self):
+        return len(self.docstore_ids)
+
+    def search(self, query, k = 5):
+        # returns [(docstore_id, score)] best first
+        scores = np.zeros(len(self.docstore_ids), dtype=np.float32)
+        for term in set(tokenize(query)):
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            # a term's postings list holds each row once, so plain fancy-index add is safe
+            scores[self.postings[start:end]] += self.weights[start:end]
+
+        matched = np.flatnonzero(scores)
+        if len(matched) > k:
+            matched = matched[np.argpartition(scores[matched], -k)[-k:]]
+        matched = matched[np.argsort(-scores[matched])]
+        return [(self.docstore_ids[row], float(scores[row])) for row in matched]
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            np.savez(f, offsets=self.offsets, postings=self.postings, weights=self.weights,
+                     meta=np.frombuffer(json.dumps({"vocabulary": self.vocabulary, "docstore_ids": self.docstore_ids}).encode("utf-8"), dtype=np.uint8))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            meta = json.loads(data["meta"].tobytes().decode("utf-8"))
+            return cls(meta["vocabulary"], data["offsets"], data["postings"], data["weights"], meta["docstore_ids"])
+
+
+def build_lexical_index(vector_store):
+    docstore_ids = list(vector_store.index_to_docstore_id.values())
+    texts = [vector_store.docstore.search(docstore_id).page_content for docstore_id in docstore_ids]
+    return BM25Index.build(texts, docstore_ids)
+
+
+def refresh_lexical_index(vector_store):
+    vector_store.lexical_index = build_lexical_index(vector_store)
+    vector_store.lexical_stale = False
+    return vector_store.lexical_index
+
+
+def mark_lexical_index_stale(vector_store):
+    # BM25 weights depend on corpus-wide statistics, so adding or removing a document changes
+    # every posting; it is rebuilt once, on the next query that needs it, not on every upload
+    vector_store.lexical_stale = True
+
+
+def current_lexical_index(vector_store):
+    if getattr(vector_store, "lexical_stale", False):
+        return refresh_lexical_index(vector_store)
+    return getattr(vector_store, "lexical_index", None)
+
+
+def reciprocal_rank_fusion(rankings, k = RRF_K):
+    # rankings: lists of docstore ids, best first
+    scores = {}
+    for ranking in rankings:
+        for rank, docstore_id in enumerate(ranking):
+            scores[docstore_id] = scores.get(docstore_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
@@ -0,0 +1,95 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from langchain_core.documents import Document
+from pypdf import PdfReader
+
+from RAG.index_cache import file_hash
+from observability import tracing
+
+WINDOW_PAGES = 16
+PARSE_WORKERS = min(4, os.cpu_count() or 1)
+
+_open_reader = (None, None)
+
+
+def _reader(pdf_path):
+    # windows of the same file usually land on the same worker, so keep the last reader open;
+    # keyed by size and mtime too, so a file replaced under the same name is read again
+    global _open_reader
+    stat = os.stat(pdf_path)
+    key = (pdf_path, stat.st_size, stat.st_mtime_ns)
+    if _open_reader[0] != key:
+        _open_reader = (key, PdfReader(pdf_path))
+    return _open_reader[1]
+
+
+def page_count(pdf_path):
+    return len(PdfReader(pdf_path).pages)
+
+
+def _parse_window(pdf_path, start, stop, text_splitter):
+    # returns (chunks, load seconds, split seconds); workers time themselves and the
+    # parent records the spans
+    load_start = time.perf_counter()
+    reader = _reader(pdf_path)
+    pages = []
+    for page_number in range(start, stop):
+        text = reader.pages[page_number].extract_text() or ""
+        pages.append(Document(
+            page_content=text,
+            metadata={"source": pdf_path, "page": page_number, "total_pages": len(reader.pages)}))
+    split_start = time.perf_counter()
+    chunks = text_splitter.split_documents(pages)
+    return chunks, split_start - load_start, time.perf_counter() - split_start
+
+
+def _traced_chunks(result, pdf_path, start, stop):
+    chunks, load_seconds, split_seconds = result
+    tracing.record("pdf.load", load_seconds * 1000, source=os.path.basename(pdf_path), pages=stop - start, first_page=start)
+    tracing.record("pdf.chunk", split_seconds * 1000, source=os.path.basename(pdf_path), pages=stop - start, chunks=len(chunks))
+    return chunks
+
+
+def _windows(pdf_paths, window_pages):
+    for pdf_path in pdf_paths:
+        total = page_count(pdf_path)
+        for start in range(0, total, window_pages):
+            yield pdf_path, start, min(start + window_pages, total)
+
+
+def _tag(chunks, pdf_path, doc_ids, counters):
+    # ids are assigned in page order, so they are stable across runs and worker counts
+    if pdf_path not in doc_ids:
+        doc_ids[pdf_path] = file_hash(pdf_path)
+    doc_id = doc_ids[pdf_path]
+    for chunk in chunks:
+        chunk.metadata["doc_id"] = doc_id
+        chunk.id = f"{doc_id}-{counters.get(pdf_path, 0)}"
+        counters[pdf_path] = counters.get(pdf_path, 0) + 1
+        yield chunk
+
+
+def iter_pdf_chunks(pdf_paths, text_splitter, num_workers = PARSE_WORKERS, window_pages = WINDOW_PAGES, doc_ids = None):
+    # yields chunks in document/page order while later windows are still being parsed;
+    # at most 2 * num_workers windows of pages are held at once
+    doc_ids = dict(doc_ids or {})
+    counters = {}
+    if num_workers <= 1:
+        for pdf_path, start, stop in _windows(pdf_paths, window_pages):
+            chunks = _traced_chunks(_parse_window(pdf_path, start, stop, text_splitter), pdf_path, start, stop)
+            yield from _tag(chunks, pdf_path, doc_ids, counters)
+        return
+
+    with ProcessPoolExecutor(num_workers) as pool:
+        pending = deque()
+        for pdf_path, start, stop in _windows(pdf_paths, window_pages):
+            pending.append(((pdf_path, start, stop), pool.submit(_parse_window, pdf_path, start, stop, text_splitter)))
+            if len(pending) >= 2 * num_workers:
+                window, future = pending.popleft()
+                yield from _tag(_traced_chunks(future.result(), *window), window[0], doc_ids, counters)
+        while pending:
+            window, future = pending.popleft()
+            yield from _tag(_traced_chunks(future.result(), *window), window[0], doc_ids, counters)
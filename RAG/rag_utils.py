@@ -2,56 +2,222 @@
 # from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_huggingface import HuggingFaceEmbeddings
 # import py
-from langchain_community.document_loaders import PyPDFLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
-from langchain_community.docstore.in_memory import InMemoryDocstore
-from langchain_community.vectorstores import FAISS
-import faiss
+import math
 import os
+import shutil
+import threading
+import weakref
+
+import numpy as np
+
+from RAG import index_cache
+from RAG.ingest import EMBED_BATCH_SIZE, build_vector_store, new_vector_store
+from RAG.index_cache import INDEX_CACHE_PATH as FAISS_INDEX_PATH, file_hash
+from RAG.pdf_stream import PARSE_WORKERS, iter_pdf_chunks, page_count
+from RAG.lexical import RRF_K, current_lexical_index, reciprocal_rank_fusion, refresh_lexical_index
+from RAG.rerank import RERANK_FETCH_K
+from observability.tracing import span
 
 DOCS_PATH = os.path.abspath("docs")
-# FAISS_INDEX_PATH = os.path.abspath(os.path.join("faiss_index"))
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+# the chunk count is only known after parsing; a page of lecture notes is ~2400 characters
+PAGE_CHARS_ESTIMATE = 2400
+# DEEPLEARN_INDEX_QUANTIZE=float16|int8|pq compresses the vectors of shared indexes
+SHARED_INDEX_QUANTIZE = os.environ.get("DEEPLEARN_INDEX_QUANTIZE") or None
 
 
-def load_chunk_pdfs(embedding_model, doc_dir = DOCS_PATH):
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-    chunks = []
-    for file in os.listdir(doc_dir):
-        if file.endswith(".pdf"):
-            pdf_path = os.path.join(doc_dir, file)
-            loader = PyPDFLoader(pdf_path)
-            chunks.extend(loader.load_and_split(text_splitter))
+def list_pdfs(doc_dir = DOCS_PATH):
+    return [os.path.join(doc_dir, file) for file in sorted(os.listdir(doc_dir)) if file.endswith(".pdf")]
 
-    index = faiss.IndexFlatL2(len(embedding_model.embed_query("test")))
-    vector_store = FAISS(
-    embedding_function=embedding_model,
-    index=index,
-    docstore=InMemoryDocstore(),
-    index_to_docstore_id={})
+def unique_pdfs(pdf_paths):
+    # {pdf_path: doc_id}; byte-identical copies (notes.pdf, "notes (1).pdf") share a content hash
+    # and therefore chunk ids, so only the first one is indexed
+    by_hash = {}
+    for pdf_path in pdf_paths:
+        by_hash.setdefault(file_hash(pdf_path), pdf_path)
+    return {pdf_path: doc_id for doc_id, pdf_path in by_hash.items()}
 
-    vector_store.add_documents(chunks)
-    return vector_store
+def estimate_chunks(num_pages, chunk_size = CHUNK_SIZE, chunk_overlap = CHUNK_OVERLAP):
+    # sizes the process pool, the "auto" index type and trained indexes before any chunk exists
+    return math.ceil(num_pages * PAGE_CHARS_ESTIMATE / max(1, chunk_size - chunk_overlap))
 
-def clear_index_path():
-    for file in os.listdir(FAISS_INDEX_PATH):
-        os.remove(os.path.join(FAISS_INDEX_PATH, file))
+def chunk_pdf(pdf_path, text_splitter, doc_id = None, num_workers = PARSE_WORKERS):
+    # chunks carry their document's content hash so they can be removed per document later
+    doc_ids = {pdf_path: doc_id} if doc_id else None
+    return list(iter_pdf_chunks([pdf_path], text_splitter, num_workers=num_workers, doc_ids=doc_ids))
 
+def _index_key(doc_dir, embedding_model, chunk_size, chunk_overlap, quantize, index_type, index_params):
+    # returns (cache key, {pdf_path: doc_id}) for the PDFs of doc_dir
+    with span("index.cache_key") as key_span:
+        doc_ids = unique_pdfs(list_pdfs(doc_dir))
+        key_span.set(documents=len(doc_ids))
+        key = index_cache.cache_key(list(doc_ids), embedding_model, file_hashes=list(doc_ids.values()), chunk_size=chunk_size,
+                                    chunk_overlap=chunk_overlap, quantize=quantize, index_type=index_type, index_params=index_params)
+        return key, doc_ids
 
-def retrieve_from_index(index, query, k=5):
-    retriever = index.as_retriever(search_kwargs={"k": k})
-    docs = retriever.invoke(query)
-    return docs
+def load_chunk_pdfs(embedding_model, doc_dir = DOCS_PATH, chunk_size = CHUNK_SIZE, chunk_overlap = CHUNK_OVERLAP, use_cache = True,
+                    batch_size = EMBED_BATCH_SIZE, num_workers = None, quantize = None, parse_workers = PARSE_WORKERS,
+                    index_type = "flat", index_params = None):
+    with span("rag.load_chunk_pdfs", index_type=index_type, quantize=quantize) as load_span:
+        key, doc_ids = _index_key(doc_dir, embedding_model, chunk_size, chunk_overlap, quantize, index_type, index_params)
+        pdf_paths = list(doc_ids)
+        if use_cache:
+            with span("index.load"):
+                cached = index_cache.load_cached_index(key, embedding_model)
+            if cached is not None:
+                load_span.set(cache="hit", chunks=len(cached.index_to_docstore_id))
+                return cached
 
-def retrieve_all_from_index(db):
-    num_docs = len(db.index_to_docstore_id)
+        text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        # parsing runs ahead in worker processes while the embedder consumes chunks
+        chunks = iter_pdf_chunks(pdf_paths, text_splitter, num_workers=parse_workers, doc_ids=doc_ids)
+        with span("pdf.count_pages", documents=len(pdf_paths)) as count_span:
+            num_pages = sum(page_count(pdf_path) for pdf_path in pdf_paths)
+            num_chunks = estimate_chunks(num_pages, chunk_size, chunk_overlap)
+            count_span.set(pages=num_pages, estimated_chunks=num_chunks)
+        # the chunk store is a file of the cache entry; without a cache there is nowhere to keep it
+        chunk_store_path = index_cache.staging_path(key) if use_cache else None
+        try:
+            with span("index.build"):
+                vector_store = build_vector_store(embedding_model, chunks, batch_size=batch_size, num_workers=num_workers,
+                                                  quantize=quantize, index_type=index_type, index_params=index_params, num_chunks=num_chunks,
+                                                  chunk_store_path=chunk_store_path)
+            with span("lexical.build"):
+                refresh_lexical_index(vector_store)
+            if use_cache:
+                with span("index.save"):
+                    index_cache.save_index(key, vector_store)
+        finally:
+            # moved into the cache entry by save_index; only a failed build leaves it behind
+            if chunk_store_path is not None:
+                shutil.rmtree(chunk_store_path, ignore_errors=True)
+        load_span.set(cache="miss", pages=num_pages, chunks=len(vector_store.index_to_docstore_id))
+        return vector_store
+
+_shared_indexes = weakref.WeakValueDictionary()
+_shared_lock = threading.Lock()
+
+def load_shared_index(embedding_model, doc_dir = DOCS_PATH, chunk_size = CHUNK_SIZE, chunk_overlap = CHUNK_OVERLAP,
+                      quantize = SHARED_INDEX_QUANTIZE, index_type = "flat", index_params = None):
+    # One read-only store per corpus and configuration for the whole process. The FAISS index
+    # and the chunk texts are memory-mapped from the index cache, so every session holding it
+    # shares the same pages; it is dropped once no session references it.
+    with span("rag.load_shared_index", quantize=quantize) as load_span:
+        key, _ = _index_key(doc_dir, embedding_model, chunk_size, chunk_overlap, quantize, index_type, index_params)
+        with _shared_lock:
+            vector_store = _shared_indexes.get(key)
+            if vector_store is not None:
+                load_span.set(shared="hit")
+                return vector_store
+            vector_store = index_cache.load_cached_index(key, embedding_model, read_only=True)
+            if vector_store is None or getattr(vector_store, "chunk_store", None) is None:
+                # build it, or rebuild an entry saved without a chunk store, then reopen it memory-mapped
+                index_cache.invalidate(key)
+                load_chunk_pdfs(embedding_model, doc_dir, chunk_size, chunk_overlap, quantize=quantize,
+                                index_type=index_type, index_params=index_params)
+                vector_store = index_cache.load_cached_index(key, embedding_model, read_only=True)
+                if vector_store is None or getattr(vector_store, "chunk_store", None) is None:
+                    # e.g. another process invalidated or evicted the entry in between
+                    raise RuntimeError(f"the index of {doc_dir} was built but could not be reopened from the index cache at {FAISS_INDEX_PATH}")
+            _shared_indexes[key] = vector_store
+            load_span.set(shared="miss", chunks=len(vector_store.index_to_docstore_id))
+            return vector_store
+
+def clear_index_path(key = None):
+    index_cache.invalidate(key)
+
+
+def get_retriever(index, k=5):
+    # retrievers are reused per (index, k) instead of being rebuilt on every query; they live on
+    # the store (a retriever references its store), so they go away together
+    per_index = getattr(index, "retrievers", None)
+    if per_index is None:
+        per_index = index.retrievers = {}
+    if k not in per_index:
+        per_index[k] = index.as_retriever(search_kwargs={"k": k})
+    return per_index[k]
 
-    docs = []
-    for i in range(num_docs):
-        doc_id = db.index_to_docstore_id[i]
-        document = db.docstore.search(doc_id)
+def _embed_queries(embedding_model, queries):
+    # embed_query can differ from embed_documents (query instructions, query_encode_kwargs), so
+    # queries are only batched through embed_documents where the two are the same
+    if len(queries) > 1 and isinstance(embedding_model, HuggingFaceEmbeddings) and not embedding_model.query_encode_kwargs:
+        return np.asarray(embedding_model.embed_documents(list(queries)), dtype=np.float32)
+    return np.asarray([embedding_model.embed_query(query) for query in queries], dtype=np.float32)
+
+def _rankings(index, queries, k, hybrid, fetch_k=None, rrf_k=RRF_K):
+    # all queries are searched with one FAISS call, and embedded in one batch where possible
+    lexical_index = current_lexical_index(index) if hybrid else None
+    fetch_k = fetch_k or (4 * k if lexical_index is not None else k)
+    with span("embed.query", queries=len(queries)):
+        query_vectors = _embed_queries(index.embedding_function, queries)
+    with span("faiss.search", queries=len(queries), k=fetch_k, rows=index.index.ntotal):
+        _, rows = index.index.search(query_vectors, fetch_k)
+
+    rankings = []
+    for query, query_rows in zip(queries, rows):
+        dense = [index.index_to_docstore_id[row] for row in query_rows if row >= 0]
+        if lexical_index is not None:
+            # dense and BM25 rankings fused with reciprocal rank fusion, so exact terms
+            # (formula names, acronyms) surface even when the embedding misses them
+            with span("bm25.search", k=fetch_k):
+                lexical = [docstore_id for docstore_id, _ in lexical_index.search(query, fetch_k)]
+            rankings.append(reciprocal_rank_fusion([dense, lexical], k=rrf_k)[:k])
+        else:
+            rankings.append(dense[:k])
+    return rankings
+
+def hybrid_retrieve(index, query, k=5, fetch_k=None, rrf_k=RRF_K):
+    ranking = _rankings(index, [query], k, True, fetch_k, rrf_k)[0]
+    return [index.docstore.search(docstore_id) for docstore_id in ranking]
+
+def retrieve_from_index(index, query, k=5, hybrid=True, reranker=None, fetch_k=RERANK_FETCH_K):
+    with span("rag.retrieve", k=k, hybrid=hybrid, rerank=reranker is not None):
+        if reranker is not None:
+            # over-fetch candidates and let the cross-encoder pick the best k for the prompt
+            candidates = retrieve_from_index(index, query, k=max(fetch_k, k), hybrid=hybrid)
+            with span("rerank", candidates=len(candidates)) as rerank_span:
+                docs = reranker.rerank(query, candidates, top_n=k)
+                rerank_span.set(**reranker.last_stats)
+            return docs
+        if hybrid and current_lexical_index(index) is not None:
+            return hybrid_retrieve(index, query, k)
+        retriever = get_retriever(index, k)
+        with span("faiss.search", queries=1, k=k, rows=index.index.ntotal):
+            docs = retriever.invoke(query)
+        return docs
+
+def retrieve_many(index, queries, k=5, hybrid=True):
+    # returns (docs per query, deduplicated union of all hits ordered by best rank)
+    if not queries:
+        return [], []
+    with span("rag.retrieve_many", queries=len(queries), k=k, hybrid=hybrid):
+        rankings = _rankings(index, queries, k, hybrid)
+    best_rank = {}
+    for ranking in rankings:
+        for rank, docstore_id in enumerate(ranking):
+            best_rank[docstore_id] = min(rank, best_rank.get(docstore_id, rank))
+    docs = {docstore_id: index.docstore.search(docstore_id) for docstore_id in best_rank}
+    union = [docs[docstore_id] for docstore_id in sorted(best_rank, key=best_rank.get)]
+    return [[docs[docstore_id] for docstore_id in ranking] for ranking in rankings], union
+
+def iter_all_from_index(db):
+    # streams chunks in index order; served from the memory-mapped chunk store when there is one
+    chunk_store = getattr(db, "chunk_store", None)
+    if chunk_store is not None:
+        yield from chunk_store.iter_documents()
+        return
+    for i in range(len(db.index_to_docstore_id)):
+        document = db.docstore.search(db.index_to_docstore_id[i])
         if document:
-            docs.append(document)
+            yield document
+
+def retrieve_all_from_index(db):
+    with span("rag.retrieve_all") as retrieve_span:
+        docs = list(iter_all_from_index(db))
+        retrieve_span.set(chunks=len(docs))
     return docs
     
 
@@ -0,0 +1,123 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+RERANK_MODEL_NAME = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+RERANK_BATCH_SIZE = 32
+RERANK_FETCH_K = 20
+SCORE_CACHE_SIZE = 50000
+
+
+class CrossEncoderReranker:
+    # Scores (query, chunk) pairs with a small CPU cross-encoder. Scores are cached per
+    # (query, chunk), so re-asked questions and overlapping candidate sets only pay for new pairs.
+    def __init__(self, model_name = RERANK_MODEL_NAME, batch_size = RERANK_BATCH_SIZE, cache_size = SCORE_CACHE_SIZE, model = None):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self._model = model
+        self._scores = OrderedDict()
+        self._lock = threading.Lock()
+        self.last_stats = {}
+
+    @property
+    def model(self):
+        if self._model is None:
+            from sentence_transformers import CrossEncoder
+            self._model = CrossEncoder(self.model_name, device="cpu")
+        return self._model
+
+    @staticmethod
+    def _key(query, doc):
+        chunk_key = doc.id or hashlib.sha256(doc.page_content.encode("utf-8")).hexdigest()
+        return query, chunk_key
+
+    def score(self, query, docs):
+        keys = [self._key(query, doc) for doc in docs]
+        scores = [None] * len(docs)
+        with self._lock:
+            for i, key in enumerate(keys):
+                if key in self._scores:
+                    self._scores.move_to_end(key)
+                    scores[i] = self._scores[key]
+        missing = [i for i, score in enumerate(scores) if score is None]
+
+        if missing:
+            pairs = [(query, docs[i].page_content) for i in missing]
+            predicted = self.model.predict(pairs, batch_size=self.batch_size)
+            with self._lock:
+                for i, score in zip(missing, predicted):
+                    scores[i] = float(score)
+                    self._scores[keys[i]] = scores[i]
+                while len(self._scores) > self.cache_size:
+                    self._scores.popitem(last=False)
+        self.last_stats = {"candidates": len(docs), "cache_hits": len(docs) - len(missing), "scored": len(missing)}
+        return scores
+
+    def rerank(self, query, docs, top_n = 5):
+        start = time.perf_counter()
+        scores = self.score(query, docs)
+        order = sorted(range(len(docs)), key=lambda i: scores[i], reverse=True)[:top_n]
+        self.last_stats["latency_ms"] = (time.perf_counter() - start) * 1000
+        return [docs[i] for i in order]
+
+
+def _percentiles(values):
+    if not values:
+        return {"p50": 0.0, "p95": 0.0}
+    return {"p50": float(np.percentile(values, 50)), "p95": float(np.percentile(values, 95))}
+
+
+def evaluate_reranker(index, labelled_queries, reranker, k = 5, fetch_k = RERANK_FETCH_K):
+    # labelled_queries: [{"query": ..., "relevant": [docstore ids]}]; compares plain top-k
+    # retrieval with over-fetch + rerank on hit rate, MRR, prompt size and latency
+    from RAG.rag_utils import retrieve_from_index
+    from llm_outputs.context_packing import count_tokens
+
+    report = {}
+    for mode in ("baseline", "rerank"):
+        hits, reciprocal_ranks, latencies, tokens = [], [], [], []
+        for item in labelled_queries:
+            relevant = set(item.get("relevant", []))
+            start = time.perf_counter()
+            if mode == "baseline":
+                docs = retrieve_from_index(index, item["query"], k=k)
+            else:
+                docs = retrieve_from_index(index, item["query"], k=k, reranker=reranker, fetch_k=fetch_k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            tokens.append(sum(count_tokens(doc.page_content) for doc in docs))
+            ranks = [rank for rank, doc in enumerate(docs) if doc.id in relevant]
+            if relevant:
+                hits.append(1.0 if ranks else 0.0)
+                reciprocal_ranks.append(1.0 / (ranks[0] + 1) if ranks else 0.0)
+        report[mode] = {
+            "hit_rate": float(np.mean(hits)) if hits else None,
+            "mrr": float(np.mean(reciprocal_ranks)) if reciprocal_ranks else None,
+            "latency_ms": _percentiles(latencies),
+            "prompt_tokens_mean": float(np.mean(tokens)) if tokens else 0.0,
+        }
+    report["config"] = {"k": k, "fetch_k": fetch_k, "model": reranker.model_name, "batch_size": reranker.batch_size}
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+    from langchain_huggingface import HuggingFaceEmbeddings
+    from RAG.rag_utils import load_chunk_pdfs
+
+    parser = argparse.ArgumentParser(description="Compare top-k retrieval with cross-encoder reranking")
+    parser.add_argument("queries", help="JSONL file of {\"query\": ..., \"relevant\": [docstore ids]}")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--fetch-k", type=int, default=RERANK_FETCH_K)
+    parser.add_argument("--model", default=RERANK_MODEL_NAME)
+    args = parser.parse_args()
+
+    with open(args.queries) as f:
+        labelled = [json.loads(line) for line in f if line.strip()]
+    embedding_model = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+    index = load_chunk_pdfs(embedding_model)
+    print(json.dumps(evaluate_reranker(index, labelled, CrossEncoderReranker(args.model), args.k, args.fetch_k), indent=2))
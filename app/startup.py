@@ -0,0 +1,171 @@
+import importlib
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Future
+
+from observability import tracing
+
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+# what the first upload and the tabs need; imported in the background after the first render
+PREFETCH_MODULES = [
+    "RAG.rag_utils",
+    "RAG.corpus",
+    "llm_outputs.model_invoke",
+    "llm_outputs.mindmap_engine",
+    "llm_outputs.response_cache",
+    "streamlit_agraph",
+]
+
+_clock_start = time.perf_counter()
+import_times = {}
+_import_lock = threading.Lock()
+
+
+def process_age():
+    # seconds since this process started (Linux), so cold-start figures include interpreter
+    # and streamlit boot; None where /proc is unavailable
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return uptime - start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def timed_import(name):
+    # always through import_module: it waits on the module's import lock, so a module another
+    # thread is still importing is never returned half initialised
+    importing = name not in sys.modules
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    if importing:
+        # the importer of a module pays for it and its not-yet-imported dependencies
+        with _import_lock:
+            import_times.setdefault(name, time.perf_counter() - start)
+    return module
+
+
+class LazyModule:
+    # stands in for a module and imports it on first attribute access
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = timed_import(self._name)
+        return getattr(self._module, attr)
+
+
+def lazy_module(name):
+    return LazyModule(name)
+
+
+class Startup:
+    # Background work that gets a server process ready for its first request: the embedding
+    # model is loaded (and run once), the LLM is loaded into ollama with a keep-alive, and the
+    # heavy modules are imported. Nothing here blocks the first render.
+    def __init__(self, embedding_model_name = EMBEDDING_MODEL_NAME, warm_up_llm = True, prefetch = PREFETCH_MODULES):
+        self.embedding_model_name = embedding_model_name
+        self.warm_up_llm = warm_up_llm
+        self.prefetch = list(prefetch)
+        self.timings = {}
+        self.errors = {}
+        self._embedding = Future()
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._started = None
+
+    def start(self):
+        self._started = time.perf_counter()
+        tasks = [("embedding_model", self._load_embedding_model), ("prefetch", self._prefetch)]
+        if self.warm_up_llm:
+            tasks.append(("llm_warm_up", self._warm_up))
+        self._pending = len(tasks)
+        for name, task in tasks:
+            threading.Thread(target=self._run, args=(name, task), name=f"startup-{name}", daemon=True).start()
+        return self
+
+    def _run(self, name, task):
+        start = time.perf_counter()
+        try:
+            task()
+        except Exception as error:
+            # a missing ollama server must not keep the app from starting
+            self.errors[name] = f"{type(error).__name__}: {error}"
+        finally:
+            with self._lock:
+                self.timings[name] = time.perf_counter() - start
+                done = self._pending == 1
+                if done:
+                    # recorded before ready() can report True
+                    self.timings["time_to_ready"] = time.perf_counter() - self._started
+                    age = process_age()
+                    if age is not None:
+                        self.timings["process_start_to_ready"] = age
+                self._pending -= 1
+            # part of the trace and of report(), not of the server's stdout
+            tracing.record(f"startup.{name}", self.timings[name] * 1000, error=self.errors.get(name))
+            if done:
+                tracing.record("startup.ready", self.timings["time_to_ready"] * 1000,
+                               **{f"{key}_s": round(value, 3) for key, value in self.timings.items()})
+
+    def _load_embedding_model(self):
+        try:
+            HuggingFaceEmbeddings = timed_import("langchain_huggingface").HuggingFaceEmbeddings
+            model = HuggingFaceEmbeddings(model_name=self.embedding_model_name)
+            # the first forward pass is much slower than the rest, so pay it here
+            model.embed_query("warm up")
+        except BaseException as error:
+            self._embedding.set_exception(error)
+            raise
+        self._embedding.set_result(model)
+
+    def _warm_up(self):
+        model_name = timed_import("llm_outputs.model_invoke").MODEL_NAME
+        timed_import("llm_outputs.ollama_pool").warm_up(model_name)
+
+    def _prefetch(self):
+        failed = []
+        for name in self.prefetch:
+            try:
+                timed_import(name)
+            except ImportError as error:
+                failed.append(f"{name}: {error}")
+        if failed:
+            raise ImportError("; ".join(failed))
+
+    def embedding_model(self, timeout = None):
+        return self._embedding.result(timeout)
+
+    def embedding_ready(self):
+        return self._embedding.done() and self._embedding.exception() is None
+
+    def ready(self):
+        return self._started is not None and self._pending == 0
+
+    def status(self):
+        if "embedding_model" in self.errors:
+            return f"Embedding model failed to load: {self.errors['embedding_model']}"
+        if not self.embedding_ready():
+            return "Loading embedding model..."
+        if not self.ready():
+            return "Warming up..."
+        return f"Ready in {self.timings['time_to_ready']:.1f}s"
+
+    def report(self):
+        return {
+            "ready": self.ready(),
+            "since_start_s": time.perf_counter() - (self._started or _clock_start),
+            "timings_s": dict(self.timings),
+            "imports_s": dict(import_times),
+            "errors": dict(self.errors),
+        }
+
+
+def start(**kwargs):
+    return Startup(**kwargs).start()
@@ -1,31 +1,120 @@
 import sys
 import os
+import json
+import uuid
+from contextlib import contextmanager
 import streamlit as st
-import streamlit_agraph as stgraph
-from streamlit_agraph import Node as stgraphNode
-from streamlit_agraph import Edge as stgraphEdge
-from streamlit_agraph import Config, agraph
-from langchain_community.embeddings import HuggingFaceEmbeddings
 
 # Add parent directory to path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from llm_outputs import model_invoke
+from app import startup
+from llm_outputs import ollama_pool
+from observability import tracing
+
+# heavy modules (LangChain, FAISS, torch, agraph) are imported on first use, and in the
+# background by the startup prefetch, so the first render does not wait for them
+stgraph = startup.lazy_module("streamlit_agraph")
+model_invoke = startup.lazy_module("llm_outputs.model_invoke")
+mindmap_engine = startup.lazy_module("llm_outputs.mindmap_engine")
+response_cache = startup.lazy_module("llm_outputs.response_cache")
 # from llm_outputs.model_invoke import Concept, Concepts, Node, RootNode, Question_Answer, Quiz
-from RAG.rag_utils import load_chunk_pdfs, retrieve_from_index, retrieve_all_from_index
+rag_utils = startup.lazy_module("RAG.rag_utils")
+corpus = startup.lazy_module("RAG.corpus")
+rerank = startup.lazy_module("RAG.rerank")
 
 # Setup page config
 st.set_page_config(layout="wide", page_title="DeepLearn")
 
 @st.cache_resource
+def get_startup():
+    # once per server process: embedding model load, LLM warm-up and import prefetch
+    return startup.start()
+
+boot = get_startup()
+
 def get_embedding_model():
-    return HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+    # blocks only if the background load has not finished yet
+    return boot.embedding_model()
+
+@st.cache_resource
+def get_response_cache():
+    # shared by every session, so repeated and paraphrased requests skip the LLM call
+    return response_cache.ResponseCache(embedding_model=get_embedding_model())
+
+# every LLM call needs an index, and an index needs the embedding model, so the cache can
+# wait for it without delaying any request
+if boot.embedding_ready():
+    model_invoke.set_response_cache(get_response_cache())
+
+TRACE_HISTORY = 10
+
+@st.cache_resource
+def get_trace_exporter():
+    # one bounded in-memory buffer for all sessions; each session remembers its own trace ids
+    return tracing.add_exporter(tracing.InMemoryExporter())
+
+trace_exporter = get_trace_exporter()
 
-embedding_model = get_embedding_model()
+@contextmanager
+def user_action(name, **attributes):
+    # root span for one button press; everything below (retrieval, prompt, ollama, parse) nests under it
+    with tracing.span(f"ui.{name}", **attributes) as action_span:
+        trace_ids = st.session_state.setdefault("trace_ids", [])
+        trace_ids.append(action_span.trace_id)
+        del trace_ids[:-TRACE_HISTORY]
+        yield action_span
+
+def render_trace_panel():
+    for trace_id in reversed(st.session_state.get("trace_ids", [])):
+        spans = trace_exporter.spans(trace_id)
+        root = next((s for s in spans if s.parent_id is None), None)
+        if root is None:
+            continue
+        depths = {root.span_id: 0}
+        rows = []
+        for s in sorted(spans, key=lambda s: s.start):
+            depth = depths.setdefault(s.span_id, depths.get(s.parent_id, 0) + 1)
+            rows.append({
+                "stage": "  " * depth + s.name,
+                "start ms": round((s.start - root.start) * 1000, 1),
+                "duration ms": round(s.duration_ms, 1),
+                "attributes": json.dumps(s.attributes, default=str)[:300],
+                "error": s.error or "",
+            })
+        with st.expander(f"{root.name}: {root.duration_ms:.0f} ms"):
+            st.dataframe(rows, hide_index=True)
+
+# the course library in docs/ is indexed once per server process and shared read-only by every
+# session; uploads go to uploads/<session>/ and into a private store of the session that uploaded them
+LIBRARY_PATH = os.path.abspath("docs")
+UPLOADS_PATH = os.path.abspath("uploads")
+
+def library_signature():
+    # changes whenever a library PDF is added, removed or replaced
+    if not os.path.isdir(LIBRARY_PATH):
+        return ()
+    return tuple(sorted((entry.name, entry.stat().st_size, entry.stat().st_mtime_ns)
+                        for entry in os.scandir(LIBRARY_PATH) if entry.name.endswith(".pdf")))
+
+@st.cache_resource(max_entries=2)
+def get_library_index(signature):
+    # the signature only keys the cache; sessions keep the store they opened alive
+    return rag_utils.load_shared_index(get_embedding_model(), LIBRARY_PATH)
+
+@st.cache_resource
+def get_reranker():
+    return rerank.CrossEncoderReranker()
+
+def retrieve(query):
+    reranker = get_reranker() if st.session_state.get("rerank") else None
+    return rag_utils.retrieve_from_index(st.session_state.index, query, reranker=reranker)
 
 # Initialize session state variables
 if 'index' not in st.session_state:
     st.session_state.index = None
+if 'shared_index' not in st.session_state:
+    st.session_state.shared_index = False
 if 'docs_processed' not in st.session_state:
     st.session_state.docs_processed = False
 if 'summary_result' not in st.session_state:
@@ -36,34 +125,96 @@ if 'mindmap_desc_map' not in st.session_state:
     st.session_state.mindmap_desc_map = {}
 if 'quiz_data' not in st.session_state:
     st.session_state.quiz_data = None
+if 'upload_dir' not in st.session_state:
+    # sessions uploading a file of the same name must not overwrite each other's PDF
+    st.session_state.upload_dir = os.path.join(UPLOADS_PATH, uuid.uuid4().hex)
+
+def reset_results():
+    st.session_state.summary_result = ""
+    st.session_state.mindmap_data = None
+    st.session_state.mindmap_desc_map = {}
+    st.session_state.quiz_data = None
+
+def open_library():
+    with st.spinner("Loading course library..."), user_action("open_library"):
+        st.session_state.index = get_library_index(library_signature())
+        model_invoke.set_response_cache(get_response_cache())
+    st.session_state.shared_index = True
+    st.session_state.docs_processed = True
+    reset_results()
 
 def process_uploaded_file(uploaded_file):
     if uploaded_file is not None:
-        # Clear docs folder
-        docs_path = os.path.abspath("docs")
-        if not os.path.exists(docs_path):
-            os.makedirs(docs_path)
-
-        for file in os.listdir(docs_path):
-            os.remove(os.path.join(docs_path, file))
+        os.makedirs(st.session_state.upload_dir, exist_ok=True)
 
-        file_path = os.path.join(docs_path, uploaded_file.name)
-        with open(file_path, "wb") as f:
+        file_path = os.path.join(st.session_state.upload_dir, os.path.basename(uploaded_file.name))
+        with open(file_path + ".tmp", "wb") as f:
             f.write(uploaded_file.getbuffer())
+        os.replace(file_path + ".tmp", file_path)
         
-        with st.spinner("Processing document..."):
-            index = load_chunk_pdfs(embedding_model=embedding_model)
-            st.session_state.index = index
+        with st.spinner("Processing document..."), user_action("upload", file=uploaded_file.name):
+            # add to the live corpus instead of rebuilding it; the shared library is read-only,
+            # so an upload starts a private one
+            if st.session_state.index is None or st.session_state.shared_index:
+                st.session_state.index = rag_utils.new_vector_store(get_embedding_model())
+                st.session_state.shared_index = False
+                model_invoke.set_response_cache(get_response_cache())
+            corpus.add_document(st.session_state.index, file_path)
             st.session_state.docs_processed = True
             
             # Reset results when new file is processed
-            st.session_state.summary_result = ""
-            st.session_state.mindmap_data = None
-            st.session_state.mindmap_desc_map = {}
-            st.session_state.quiz_data = None
+            reset_results()
             
         st.success("File uploaded and processed successfully")
 
+def mindmap_config():
+    return stgraph.Config(
+        width=750,
+        height=600,
+        directed=True,
+        physics=False,
+        hierarchical=True,
+        sortMethod='directed',
+        direction='UD', # Up-Down
+        nodeSpacing=200,
+        levelSeparation=150
+    )
+
+def build_graph(node, nodes, edges, desc_map, parent=None, count="0"):
+    if hasattr(node, 'root'):
+         label = node.root
+    elif hasattr(node, 'node'):
+         label = node.node
+    else:
+        label = "Unknown"
+
+    desc_map[label] = node.description
+
+    nodes.append(
+        stgraph.Node(
+            id=count,
+            label=label,
+            size=25,
+            shape="dot",
+            font={'color': 'white'}
+        )
+    )
+    
+    if parent:
+        edges.append(stgraph.Edge(source=parent, target=count))
+
+    child_count = 0
+    for child in node.children:
+        build_graph(child, nodes, edges, desc_map, parent=count, count=count + "_" + str(child_count))
+        child_count += 1
+
+def remove_indexed_document(doc_id):
+    corpus.remove_document(st.session_state.index, doc_id)
+    if not corpus.list_documents(st.session_state.index):
+        st.session_state.index = None
+        st.session_state.docs_processed = False
+    reset_results()
+
 if __name__ == "__main__":
     st.title("DeepLearn")
     st.subheader("RAG Powered Learning Assistant")
@@ -76,9 +227,31 @@ if __name__ == "__main__":
         if uploaded_file:
             if st.button("Process PDF"):
                 process_uploaded_file(uploaded_file)
+
+        library = library_signature()
+        if library and not st.session_state.shared_index:
+            if st.button(f"Open course library ({len(library)} PDFs)", help="Read-only index shared by every session"):
+                open_library()
+                st.rerun()
         
+        st.caption(boot.status())
+        if boot.embedding_ready():
+            cache_stats = get_response_cache().stats()
+            st.caption(f"Response cache: {cache_stats['entries']} entries, {cache_stats['hit_rate']:.0%} hit rate")
+        scheduler_stats = ollama_pool.metrics()
+        st.caption(f"LLM queue: {scheduler_stats['active']}/{scheduler_stats['limit']} running, {scheduler_stats['queue_depth']} waiting")
+
+        st.checkbox("Rerank retrieved chunks", key="rerank", help="Over-fetch candidates and keep the best ones with a cross-encoder")
+
         if st.session_state.index:
             st.success("Index Ready")
+            st.subheader("Course library" if st.session_state.shared_index else "Documents")
+            for doc_id, source in corpus.list_documents(st.session_state.index).items():
+                col_name, col_remove = st.columns([4, 1])
+                col_name.write(os.path.basename(source or doc_id))
+                if not st.session_state.shared_index and col_remove.button("Remove", key=f"remove_{doc_id}"):
+                    remove_indexed_document(doc_id)
+                    st.rerun()
 
     if st.session_state.index:
         tabs = st.tabs(["Summary", "QnA", "Quiz", "Mindmap"])
@@ -87,16 +260,29 @@ if __name__ == "__main__":
         with tabs[0]:
             st.title("Summary")
             topic = st.text_input("Enter your topic for summary", key="summary_topic")
+            whole_document = st.checkbox("Summarize the whole document", key="summary_whole")
+            streamed = False
             if st.button("Generate Summary"):
-                if topic:
-                    with st.spinner("Generating summary..."):
-                        docs = retrieve_from_index(st.session_state.index, topic)
-                        summary = model_invoke.model_invoke_summary(docs)
-                        st.session_state.summary_result = summary
+                if whole_document:
+                    progress_bar = st.progress(0.0, text="Summarizing sections...")
+                    with user_action("summary", whole_document=True):
+                        docs = rag_utils.retrieve_all_from_index(st.session_state.index)
+                        summary = model_invoke.model_invoke_summary_map_reduce(
+                            docs, progress=lambda done, total: progress_bar.progress(done / total, text=f"Summarized {done}/{total} sections"))
+                    progress_bar.empty()
+                    st.session_state.summary_result = summary
+                elif topic:
+                    with user_action("summary"):
+                        with st.spinner("Retrieving context..."):
+                            docs = retrieve(topic)
+                        # render tokens as they arrive instead of waiting for the full summary
+                        summary = st.write_stream(model_invoke.model_invoke_summary_stream(docs))
+                    st.session_state.summary_result = summary
+                    streamed = True
                 else:
                     st.warning("Please enter a topic.")
             
-            if st.session_state.summary_result:
+            if st.session_state.summary_result and not streamed:
                 st.write(st.session_state.summary_result)
         
         # --- QnA Tab ---
@@ -105,10 +291,10 @@ if __name__ == "__main__":
             query = st.text_input("Enter your query", key="qna_query")
             if st.button("Get Answer"):
                 if query:
-                    with st.spinner("Fetching answer..."):
-                        docs = retrieve_from_index(st.session_state.index, query)
-                        answer = model_invoke.model_invoke_qna(query, docs)
-                        st.write(answer)
+                    with user_action("qna"):
+                        with st.spinner("Retrieving context..."):
+                            docs = retrieve(query)
+                        st.write_stream(model_invoke.model_invoke_qna_stream(query, docs))
                 else:
                     st.warning("Please enter a query.")
 
@@ -118,10 +304,16 @@ if __name__ == "__main__":
             topic = st.text_input("Enter your topic for quiz", key="quiz_topic")
             if st.button("Generate Quiz"):
                 if topic:
-                    with st.spinner("Generating quiz..."):
-                        docs = retrieve_from_index(st.session_state.index, topic)
-                        quiz = model_invoke.model_invoke_generate_quiz(topic, docs)
-                        st.session_state.quiz_data = quiz
+                    with st.spinner("Generating quiz..."), user_action("quiz"):
+                        docs = retrieve(topic)
+                        # questions are shown as soon as each one is complete and valid
+                        questions = []
+                        live_quiz = st.empty()
+                        for question in model_invoke.model_invoke_generate_quiz_stream(topic, docs):
+                            questions.append(question)
+                            live_quiz.markdown("\n\n".join(f"**Q{i+1}: {q.question}**" for i, q in enumerate(questions)))
+                        live_quiz.empty()
+                        st.session_state.quiz_data = model_invoke.Quiz(quiz=questions) if questions else None
                 else:
                     st.warning("Please enter a topic.")
             
@@ -138,68 +330,39 @@ if __name__ == "__main__":
             
             if st.button("Generate Mindmap"):
                 if topic:
-                    with st.spinner("Generating mindmap..."):
-                        docs = retrieve_from_index(st.session_state.index, topic)
+                    with st.spinner("Extracting concepts..."), user_action("concepts"):
+                        docs = retrieve(topic)
                         concepts = model_invoke.concept_extraction(docs)
-                        if concepts:
-                            mindmap = model_invoke.generate_mindmap(concepts)
-                            if mindmap:
-                                nodes = []
-                                edges = []
-                                desc_map = {}
-
-                                def build_graph(node, parent=None, count="0"):
-                                    if hasattr(node, 'root'):
-                                         label = node.root
-                                    elif hasattr(node, 'node'):
-                                         label = node.node
-                                    else:
-                                        label = "Unknown"
-
-                                    desc_map[label] = node.description
-
-                                    nodes.append(
-                                        stgraphNode(
-                                            id=count,
-                                            label=label,
-                                            size=25,
-                                            shape="dot",
-                                            font={'color': 'white'}
-                                        )
-                                    )
-                                    
-                                    if parent:
-                                        edges.append(stgraphEdge(source=parent, target=count))
-
-                                    child_count = 0
-                                    for child in node.children:
-                                        build_graph(child, parent=count, count=count + "_" + str(child_count))
-                                        child_count += 1
-
-                                build_graph(mindmap)
-                                
-                                st.session_state.mindmap_data = (nodes, edges)
-                                st.session_state.mindmap_desc_map = desc_map
-                        else:
-                            st.error("Could not extract concepts.")
+                    if concepts:
+                        nodes = []
+                        edges = []
+                        desc_map = {}
+                        # branches are expanded concurrently and drawn as each one completes
+                        live_graph = st.empty()
+                        with st.spinner("Generating mindmap..."), user_action("mindmap"):
+                            events = mindmap_engine.iter_mindmap(topic, concepts)
+                            _, pending, root = next(events)
+                            build_graph(root, nodes, edges, desc_map)
+                            for _, position, branch in events:
+                                build_graph(branch, nodes, edges, desc_map, parent="0", count="0_" + str(position))
+                                pending -= 1
+                                if pending > 0:
+                                    with live_graph.container():
+                                        stgraph.agraph(nodes=list(nodes), edges=list(edges), config=mindmap_config())
+                        live_graph.empty()
+
+                        st.session_state.mindmap_data = (nodes, edges)
+                        st.session_state.mindmap_desc_map = desc_map
+                    else:
+                        st.error("Could not extract concepts.")
                 else:
                     st.warning("Please enter a topic.")
 
             if st.session_state.mindmap_data:
                 nodes, edges = st.session_state.mindmap_data
-                config = Config(
-                    width=750,
-                    height=600,
-                    directed=True,
-                    physics=False,
-                    hierarchical=True,
-                    sortMethod='directed',
-                    direction='UD', # Up-Down
-                    nodeSpacing=200,
-                    levelSeparation=150
-                )
+                config = mindmap_config()
                 
-                selected = agraph(nodes=nodes, edges=edges, config=config)
+                selected = stgraph.agraph(nodes=nodes, edges=edges, config=config)
                 
                 if selected:
                     # Map unique ID back to label for lookup
@@ -210,4 +373,11 @@ if __name__ == "__main__":
                              st.subheader(selected_label)
                              st.write(st.session_state.mindmap_desc_map[selected_label])
     else:
-        st.info("Please upload a PDF document and click 'Process PDF' to begin.")
\ No newline at end of file
+        st.info("Please upload a PDF document and click 'Process PDF' to begin.")
+
+    # rendered last so the traces of this run's actions are included
+    with st.sidebar:
+        if st.checkbox("Show traces", key="debug_traces", help="Per-stage timings of your recent actions"):
+            render_trace_panel()
+            with st.expander("Startup"):
+                st.json(boot.report())
\ No newline at end of file
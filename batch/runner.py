@@ -0,0 +1,187 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from app.startup import EMBEDDING_MODEL_NAME
+from llm_outputs import mindmap_engine, model_invoke, ollama_pool
+from llm_outputs.response_cache import RESPONSE_CACHE_PATH, ResponseCache
+from observability.tracing import span
+from RAG.rag_utils import DOCS_PATH, load_chunk_pdfs, retrieve_many
+
+DEFAULT_TASKS = ["summary", "quiz"]
+DEFAULT_OUTPUT = "batch_results.jsonl"
+RETRIEVE_BATCH_SIZE = 32
+
+
+def _summary(topic, docs):
+    return model_invoke.model_invoke_summary(docs)
+
+def _quiz(topic, docs):
+    return model_invoke.model_invoke_generate_quiz(topic, docs)
+
+def _concepts(topic, docs):
+    return model_invoke.concept_extraction(docs)
+
+def _mindmap(topic, docs):
+    concepts = model_invoke.concept_extraction(docs)
+    return mindmap_engine.generate_mindmap_parallel(topic, concepts) if concepts else None
+
+
+TASKS = {"summary": _summary, "quiz": _quiz, "concepts": _concepts, "mindmap": _mindmap}
+
+
+def read_topics(path):
+    # one topic per line; blank lines, '#' comments and repeats are skipped
+    with (sys.stdin if path == "-" else open(path, encoding="utf-8")) as f:
+        lines = [line.strip() for line in f]
+    return list(dict.fromkeys(line for line in lines if line and not line.startswith("#")))
+
+
+def load_checkpoint(path):
+    # (topic, task) pairs that already have a successful record; failed ones are retried
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            # drop a record cut short by an interrupted run before appending to the file
+            f.truncate(end)
+    for line in data[:end].decode("utf-8").splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if record.get("status") == "ok":
+            done.add((record["topic"], record["task"]))
+    return done
+
+
+def run_task(topic, task, docs):
+    record = {"topic": topic, "task": task, "model": model_invoke.MODEL_NAME, "sources": [doc.id for doc in docs]}
+    start = time.perf_counter()
+    # a nightly run must never hold up students, so even summaries queue as batch work
+    with ollama_pool.priority_floor(ollama_pool.BATCH), span("batch.task", topic=topic, task=task) as task_span:
+        try:
+            result = TASKS[task](topic, docs)
+        except Exception as error:
+            record.update(status="failed", error=f"{type(error).__name__}: {error}")
+        else:
+            if result is None:
+                record.update(status="failed", error="no valid structured output")
+            else:
+                record.update(status="ok", result=result if isinstance(result, str) else result.model_dump())
+        task_span.set(status=record["status"])
+    record["elapsed_s"] = time.perf_counter() - start
+    record["finished_at"] = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+    return record
+
+
+class Runner:
+    # Retrieves topics in batches and keeps at most `concurrency` LLM tasks running. Each
+    # finished task is appended to the JSONL output right away, which is also the checkpoint.
+    def __init__(self, index, output, concurrency, k = 5, batch_size = RETRIEVE_BATCH_SIZE):
+        self.index = index
+        self.output = output
+        self.concurrency = concurrency
+        self.k = k
+        self.batch_size = batch_size
+        self.counts = {"ok": 0, "failed": 0}
+        self._in_flight = {}
+
+    def _write(self, future):
+        record = future.result()
+        self.output.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.output.flush()
+        self.counts[record["status"]] += 1
+        if record["status"] != "ok":
+            print(f"failed: {record['task']} for {record['topic']!r}: {record['error']}", file=sys.stderr)
+
+    def _drain(self, limit):
+        while len(self._in_flight) > limit:
+            finished, _ = wait(self._in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                del self._in_flight[future]
+                self._write(future)
+
+    def run(self, jobs):
+        # jobs: {topic: [tasks]}
+        topics = list(jobs)
+        pool = ThreadPoolExecutor(self.concurrency, thread_name_prefix="batch")
+        try:
+            for start in range(0, len(topics), self.batch_size):
+                batch = topics[start:start + self.batch_size]
+                # one embedding call and one FAISS search for the whole batch
+                per_topic, _ = retrieve_many(self.index, batch, k=self.k)
+                for topic, docs in zip(batch, per_topic):
+                    for task in jobs[topic]:
+                        self._in_flight[pool.submit(run_task, topic, task, docs)] = (topic, task)
+                # retrieval runs at most one batch ahead of generation
+                self._drain(self.concurrency)
+            self._drain(0)
+        except KeyboardInterrupt:
+            for future in list(self._in_flight):
+                if future.cancel():
+                    del self._in_flight[future]
+            print(f"Interrupted; waiting for {len(self._in_flight)} running tasks, rerun to resume", file=sys.stderr)
+            self._drain(0)
+            raise
+        finally:
+            pool.shutdown(wait=True)
+        return self.counts
+
+
+def parse_args(argv = None):
+    parser = argparse.ArgumentParser(description="Generate summaries, quizzes and mindmaps for a list of topics without the UI")
+    parser.add_argument("topics", help="text file with one topic per line ('-' for stdin)")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="JSONL results, also used to resume an interrupted run")
+    parser.add_argument("--tasks", type=lambda value: value.split(","), default=DEFAULT_TASKS,
+                        help=f"comma separated subset of {','.join(TASKS)}")
+    parser.add_argument("--docs", default=DOCS_PATH, help="directory of PDFs to index")
+    parser.add_argument("--k", type=int, default=5, help="chunks retrieved per topic")
+    parser.add_argument("--batch-size", type=int, default=RETRIEVE_BATCH_SIZE, help="topics retrieved per batch")
+    parser.add_argument("--concurrency", type=int, default=ollama_pool.MAX_CONCURRENT_REQUESTS, help="concurrent LLM calls")
+    parser.add_argument("--restart", action="store_true", help="ignore and overwrite existing results")
+    parser.add_argument("--response-cache", default=RESPONSE_CACHE_PATH,
+                        help="response cache to fill, so the app serves pre-generated content ('' to disable)")
+    args = parser.parse_args(argv)
+    unknown = set(args.tasks) - set(TASKS)
+    if unknown:
+        parser.error(f"unknown tasks: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main(argv = None):
+    args = parse_args(argv)
+    topics = read_topics(args.topics)
+    done = set() if args.restart else load_checkpoint(args.output)
+    jobs = {}
+    for topic in topics:
+        pending = [task for task in args.tasks if (topic, task) not in done]
+        if pending:
+            jobs[topic] = pending
+    skipped = len(topics) * len(args.tasks) - sum(len(tasks) for tasks in jobs.values())
+    print(f"{len(topics)} topics, {skipped} tasks already done, {sum(len(tasks) for tasks in jobs.values())} to run", file=sys.stderr)
+    if not jobs:
+        return
+
+    start = time.perf_counter()
+    from langchain_huggingface import HuggingFaceEmbeddings
+    embedding_model = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
+    index = load_chunk_pdfs(embedding_model, args.docs)
+    if args.response_cache:
+        model_invoke.set_response_cache(ResponseCache(args.response_cache, embedding_model=embedding_model))
+    ollama_pool.configure(max_concurrent=args.concurrency)
+
+    with open(args.output, "w" if args.restart else "a", encoding="utf-8") as output:
+        counts = Runner(index, output, args.concurrency, k=args.k, batch_size=args.batch_size).run(jobs)
+    print(f"Done in {time.perf_counter() - start:.1f}s: {counts['ok']} ok, {counts['failed']} failed, "
+          f"results in {os.path.abspath(args.output)}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,486 @@
+import argparse
+import asyncio
+import contextlib
+import gc
+import hashlib
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from benchmarks.synthetic_pdf import VOCABULARY, write_synthetic_pdf
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_PATH = os.path.join(REPO_ROOT, "benchmarks", "results")
+DEFAULT_SIZES = [10, 50, 200]
+DEFAULT_QUERIES = 50
+DEFAULT_GENERATIONS = 5
+DEFAULT_SESSIONS = 8
+SESSION_QUERIES = 10
+RSS_SAMPLE_INTERVAL = 0.01
+HASH_DIM = 384
+STAGES = ("ingest", "retrieve", "generate", "sessions")
+
+
+class HashEmbeddings(Embeddings):
+    # deterministic, model-free embedder (hashed bag of words) so runs without the
+    # sentence-transformers weights still exercise the whole ingestion/FAISS path
+    model_name = f"hash-{HASH_DIM}"
+
+    def _embed(self, text):
+        vector = np.zeros(HASH_DIM, dtype=np.float32)
+        for word in text.lower().split():
+            vector[int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % HASH_DIM] += 1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+def make_embedder(name):
+    if name == "hash":
+        return HashEmbeddings()
+    from langchain_huggingface import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_ROOT,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+
+def peak_rss_mb(who = resource.RUSAGE_SELF):
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / (1024 ** 2 if sys.platform == "darwin" else 1024)
+
+
+def current_rss_mb():
+    # resident set size right now (Linux); falls back to the peak elsewhere
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    except (OSError, ValueError, IndexError):
+        return peak_rss_mb()
+
+
+class RssSampler:
+    # peak resident set size while one stage runs, polled from a background thread; ru_maxrss
+    # only has the peak of the whole process so far
+    def __init__(self, interval = RSS_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.start_mb = self.peak_mb = current_rss_mb()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name="rss-sampler", daemon=True)
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak_mb = max(self.peak_mb, current_rss_mb())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak_mb = max(self.peak_mb, current_rss_mb())
+
+
+def latency_summary(latencies_ms):
+    values = np.asarray(latencies_ms, dtype=np.float64)
+    if not len(values):
+        return {}
+    return {
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "p99": float(np.percentile(values, 99)),
+        "mean": float(values.mean()),
+        "max": float(values.max()),
+    }
+
+
+def measure(name, fn, iterations, warmup = 1, items = 1, **info):
+    # items: units of work per call (pages, queries, chunks) used for the throughput figure
+    with RssSampler() as rss:
+        for _ in range(warmup):
+            fn()
+        latencies = []
+        result = None
+        start = time.perf_counter()
+        for _ in range(iterations):
+            call_start = time.perf_counter()
+            result = fn()
+            latencies.append((time.perf_counter() - call_start) * 1000)
+        elapsed = time.perf_counter() - start
+    record = {
+        "name": name,
+        "iterations": iterations,
+        "latency_ms": latency_summary(latencies),
+        "throughput_per_s": items * iterations / elapsed if elapsed else None,
+        # this stage only: RSS when it started and the highest RSS sampled while it ran
+        "rss_start_mb": rss.start_mb,
+        "peak_rss_mb": rss.peak_mb,
+        "peak_rss_delta_mb": rss.peak_mb - rss.start_mb,
+        # cumulative over the run so far (largest embedding worker for the children figure)
+        "process_peak_rss_mb": peak_rss_mb(),
+        "process_peak_rss_children_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+        **info,
+    }
+    return record, result
+
+
+def make_queries(count, seed = 0):
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(2, 6))) for _ in range(count)]
+
+
+def make_corpora(workdir, sizes):
+    corpora = {}
+    for size in sizes:
+        doc_dir = os.path.join(workdir, f"docs-{size}")
+        os.makedirs(doc_dir, exist_ok=True)
+        write_synthetic_pdf(os.path.join(doc_dir, f"synthetic-{size}.pdf"), size, seed=size)
+        corpora[size] = doc_dir
+    return corpora
+
+
+def bench_ingest(embedding_model, doc_dir, pages, repeats, num_workers):
+    from RAG.rag_utils import load_chunk_pdfs
+
+    records = []
+    record, vector_store = measure("load_chunk_pdfs.cold",
+                                   lambda: load_chunk_pdfs(embedding_model, doc_dir, use_cache=False, num_workers=num_workers), repeats, warmup=0, items=pages, pages=pages)
+    chunks = len(vector_store.index_to_docstore_id)
+    record["chunks"] = chunks
+    record["chunks_per_s"] = record["throughput_per_s"] * chunks / pages
+    records.append(record)
+
+    # the first call populates the index cache, the measured ones are pure cache loads
+    record, vector_store = measure("load_chunk_pdfs.cached",
+                                   lambda: load_chunk_pdfs(embedding_model, doc_dir, num_workers=num_workers),
+                                   repeats, warmup=1, items=pages, pages=pages, chunks=chunks)
+    records.append(record)
+    return records, vector_store
+
+
+def bench_retrieve(vector_store, queries, pages, k):
+    from RAG.rag_utils import retrieve_all_from_index, retrieve_from_index
+
+    chunks = len(vector_store.index_to_docstore_id)
+    records = []
+    for hybrid in (False, True):
+        name = "retrieve_from_index.hybrid" if hybrid else "retrieve_from_index.dense"
+        position = iter(range(10 ** 9))
+        record, _ = measure(name, lambda: retrieve_from_index(vector_store, queries[next(position) % len(queries)], k=k, hybrid=hybrid),
+                            len(queries), warmup=1, pages=pages, chunks=chunks, k=k)
+        records.append(record)
+    record, _ = measure("retrieve_all_from_index", lambda: retrieve_all_from_index(vector_store),
+                        max(3, len(queries) // 10), warmup=1, items=chunks, pages=pages, chunks=chunks)
+    records.append(record)
+    return records
+
+
+def _private_copy(vector_store):
+    # what every session used to hold: the index read into RAM and every chunk as a Document
+    import faiss
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_community.vectorstores import FAISS
+    from RAG.lexical import refresh_lexical_index
+    from RAG.rag_utils import iter_all_from_index
+
+    copy = FAISS(embedding_function=vector_store.embedding_function,
+                 index=faiss.deserialize_index(faiss.serialize_index(vector_store.index)),
+                 docstore=InMemoryDocstore({document.id: document for document in iter_all_from_index(vector_store)}),
+                 index_to_docstore_id=dict(vector_store.index_to_docstore_id))
+    refresh_lexical_index(copy)
+    return copy
+
+
+def bench_sessions(embedding_model, doc_dir, pages, sessions, queries, k):
+    # RSS as sessions are added, each with its own in-memory index ("private") or all
+    # referencing the shared, memory-mapped one ("shared"); every session runs a few queries
+    from RAG.rag_utils import load_chunk_pdfs, load_shared_index, retrieve_from_index
+
+    records = []
+    for mode in ("private", "shared"):
+        gc.collect()
+        before = current_rss_mb()
+        stores = []
+        growth = []
+        for _ in range(sessions):
+            if mode == "shared":
+                stores.append(load_shared_index(embedding_model, doc_dir))
+            else:
+                stores.append(_private_copy(load_chunk_pdfs(embedding_model, doc_dir)))
+            for query in queries[:SESSION_QUERIES]:
+                retrieve_from_index(stores[-1], query, k=k)
+            growth.append(current_rss_mb() - before)
+        position = iter(range(10 ** 9))
+
+        def query_any_session():
+            i = next(position)
+            return retrieve_from_index(stores[i % sessions], queries[i % len(queries)], k=k)
+
+        record, _ = measure(f"sessions.{mode}", query_any_session, len(queries), warmup=1, pages=pages,
+                            chunks=len(stores[0].index_to_docstore_id), sessions=sessions, k=k)
+        record["rss_growth_mb"] = growth
+        record["rss_per_session_mb"] = growth[-1] / sessions
+        records.append(record)
+        del stores, query_any_session
+    return records
+
+
+def _first_piece_timer(stream_fn, ttft):
+    # consumes a stream (text pieces or structured items), recording time to the first one
+    def run():
+        start = time.perf_counter()
+        pieces = []
+        for piece in stream_fn():
+            if not pieces:
+                ttft.append((time.perf_counter() - start) * 1000)
+            pieces.append(piece)
+        return pieces
+    return run
+
+
+def _async_first_piece_timer(stream_fn, ttft):
+    async def consume():
+        start = time.perf_counter()
+        pieces = []
+        async for piece in stream_fn():
+            if not pieces:
+                ttft.append((time.perf_counter() - start) * 1000)
+            pieces.append(piece)
+        return pieces
+    return lambda: asyncio.run(consume())
+
+
+def bench_generate(docs, topic, iterations, token_delay):
+    from llm_outputs import model_invoke, ollama_pool
+    from llm_outputs.stub_ollama import start_stub_server
+
+    server, url = start_stub_server(token_delay=token_delay)
+    ollama_pool.configure(host=url)
+    # every call goes to the stub: no response cache, no in-process partial summaries
+    previous_cache = model_invoke.response_cache
+    model_invoke.set_response_cache(None)
+    concepts = model_invoke.concept_extraction(docs)
+
+    def no_partials(fn):
+        def run():
+            model_invoke._partial_summaries.clear()
+            return fn()
+        return run
+
+    calls = {
+        "model_invoke_summary": lambda: model_invoke.model_invoke_summary(docs),
+        "model_invoke_qna": lambda: model_invoke.model_invoke_qna(topic, docs),
+        "model_invoke_generate_quiz": lambda: model_invoke.model_invoke_generate_quiz(topic, docs),
+        "concept_extraction": lambda: model_invoke.concept_extraction(docs),
+        "generate_mindmap": lambda: model_invoke.generate_mindmap(concepts),
+        "model_invoke_summary_map_reduce": no_partials(lambda: model_invoke.model_invoke_summary_map_reduce(docs)),
+        "amodel_invoke_summary": lambda: asyncio.run(model_invoke.amodel_invoke_summary(docs)),
+        "amodel_invoke_qna": lambda: asyncio.run(model_invoke.amodel_invoke_qna(topic, docs)),
+        "amodel_invoke_generate_quiz": lambda: asyncio.run(model_invoke.amodel_invoke_generate_quiz(topic, docs)),
+        "aconcept_extraction": lambda: asyncio.run(model_invoke.aconcept_extraction(docs)),
+        "agenerate_mindmap": lambda: asyncio.run(model_invoke.agenerate_mindmap(concepts)),
+    }
+    streams = {
+        "model_invoke_summary_stream": (_first_piece_timer, lambda: model_invoke.model_invoke_summary_stream(docs)),
+        "model_invoke_qna_stream": (_first_piece_timer, lambda: model_invoke.model_invoke_qna_stream(topic, docs)),
+        "amodel_invoke_summary_stream": (_async_first_piece_timer, lambda: model_invoke.amodel_invoke_summary_stream(docs)),
+        "amodel_invoke_qna_stream": (_async_first_piece_timer, lambda: model_invoke.amodel_invoke_qna_stream(topic, docs)),
+        "model_invoke_generate_quiz_stream": (_first_piece_timer, lambda: model_invoke.model_invoke_generate_quiz_stream(topic, docs)),
+        "concept_extraction_stream": (_first_piece_timer, lambda: model_invoke.concept_extraction_stream(docs)),
+        "generate_mindmap_stream": (_first_piece_timer, lambda: model_invoke.generate_mindmap_stream(concepts)),
+    }
+
+    records = []
+    try:
+        for name, call in calls.items():
+            record, result = measure(name, call, iterations, warmup=1, context_docs=len(docs))
+            record["parsed"] = result is not None
+            records.append(record)
+        for name, (timer, stream_fn) in streams.items():
+            ttft = []
+            record, _ = measure(name, timer(stream_fn, ttft), iterations, warmup=1, context_docs=len(docs))
+            record["first_piece_ms"] = latency_summary(ttft[1:])
+            records.append(record)
+    finally:
+        model_invoke.set_response_cache(previous_cache)
+        server.shutdown()
+    for record in records:
+        record["token_delay"] = token_delay
+    return records
+
+
+def run(args):
+    commit, dirty = git_commit()
+    workdir = args.workdir or tempfile.mkdtemp(prefix="deeplearn-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    # the index cache lives under the working directory, so keep benchmark indexes out of the app's cache
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_ROOT)
+
+    start = time.perf_counter()
+    embedding_model = make_embedder(args.embedder)
+    report = {
+        "meta": {
+            "commit": commit,
+            "dirty": dirty,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "embedder": getattr(embedding_model, "model_name", args.embedder),
+            "embedder_load_s": time.perf_counter() - start,
+            "sizes": args.sizes,
+            "stages": args.stages,
+            "queries": args.queries,
+            "generations": args.generations,
+            "sessions": args.sessions,
+            "seed": args.seed,
+        },
+        "results": [],
+    }
+    queries = make_queries(args.queries, args.seed)
+    vector_store = None
+    try:
+        corpora = make_corpora(workdir, args.sizes)
+        for size, doc_dir in corpora.items():
+            if not ({"ingest", "retrieve"} & set(args.stages)) and vector_store is not None:
+                break
+            records, vector_store = bench_ingest(embedding_model, doc_dir, size, args.repeats, args.num_workers)
+            if "ingest" in args.stages:
+                report["results"].extend(records)
+            if "retrieve" in args.stages:
+                report["results"].extend(bench_retrieve(vector_store, queries, size, args.k))
+        if "generate" in args.stages:
+            from RAG.rag_utils import retrieve_from_index
+            docs = retrieve_from_index(vector_store, queries[0], k=args.k)
+            report["results"].extend(bench_generate(docs, queries[0], args.generations, args.token_delay))
+        if "sessions" in args.stages:
+            size = max(corpora)
+            report["results"].extend(bench_sessions(embedding_model, corpora[size], size, args.sessions, queries, args.k))
+    finally:
+        if not args.workdir and not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    report["meta"]["peak_rss_mb"] = peak_rss_mb()
+    report["meta"]["total_s"] = time.perf_counter() - start
+    return report
+
+
+def _key(record):
+    return record["name"], record.get("pages")
+
+
+def compare(baseline, current):
+    # p50 and throughput ratios of current vs baseline for every benchmark present in both
+    previous = {_key(record): record for record in baseline["results"]}
+    rows = []
+    for record in current["results"]:
+        before = previous.get(_key(record))
+        if before is None:
+            continue
+        p50, p50_before = record["latency_ms"].get("p50"), before["latency_ms"].get("p50")
+        rows.append({
+            "name": record["name"],
+            "pages": record.get("pages"),
+            "p50_ms": p50,
+            "p50_ratio": p50 / p50_before if p50_before else None,
+            "throughput_ratio": record["throughput_per_s"] / before["throughput_per_s"] if before.get("throughput_per_s") else None,
+        })
+    return rows
+
+
+def print_comparison(rows, baseline_commit):
+    print(f"vs {baseline_commit}")
+    print(f"{'benchmark':<36} {'pages':>6} {'p50 ms':>10} {'p50 x':>8} {'tput x':>8}")
+    for row in rows:
+        pages = "" if row["pages"] is None else row["pages"]
+        p50_ratio = f"{row['p50_ratio']:.2f}" if row["p50_ratio"] else "-"
+        throughput_ratio = f"{row['throughput_ratio']:.2f}" if row["throughput_ratio"] else "-"
+        print(f"{row['name']:<36} {pages:>6} {row['p50_ms']:>10.2f} {p50_ratio:>8} {throughput_ratio:>8}")
+
+
+def parse_args(argv = None):
+    parser = argparse.ArgumentParser(description="End-to-end benchmarks for ingestion, retrieval and generation")
+    parser.add_argument("--sizes", type=lambda value: [int(size) for size in value.split(",")], default=DEFAULT_SIZES,
+                        help="comma separated synthetic PDF sizes in pages")
+    parser.add_argument("--stages", type=lambda value: value.split(","), default=list(STAGES),
+                        help=f"comma separated subset of {','.join(STAGES)}")
+    parser.add_argument("--embedder", choices=["minilm", "hash"], default="minilm",
+                        help="'hash' skips the sentence-transformers model for fast, model-free runs")
+    parser.add_argument("--queries", type=int, default=DEFAULT_QUERIES, help="retrieval queries per corpus size")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--repeats", type=int, default=1, help="cold/cached ingestion runs per size")
+    parser.add_argument("--generations", type=int, default=DEFAULT_GENERATIONS, help="calls per model_invoke function")
+    parser.add_argument("--sessions", type=int, default=DEFAULT_SESSIONS, help="concurrent sessions simulated by the sessions stage")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="stub LLM seconds per generated token")
+    parser.add_argument("--num-workers", type=int, default=None, help="embedding worker processes (default: automatic)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", default=None, help="where PDFs and indexes are written (default: a temporary directory)")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary working directory")
+    parser.add_argument("--output", default=None, help="JSON report path (default: benchmarks/results/<commit>.json, '-' for stdout)")
+    parser.add_argument("--compare", default=None, help="baseline JSON report to compare against")
+    args = parser.parse_args(argv)
+    unknown = set(args.stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+    if args.embedder == "hash" and args.num_workers is None:
+        # worker processes load the sentence-transformers model by name
+        args.num_workers = 1
+    return args
+
+
+def main(argv = None):
+    args = parse_args(argv)
+    output = args.output
+    if output is None:
+        commit, dirty = git_commit()
+        name = (commit[:12] if commit else "uncommitted") + ("-dirty" if dirty else "")
+        output = os.path.join(RESULTS_PATH, f"{name}.json")
+    if output != "-":
+        output = os.path.abspath(output)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    # stray output from the libraries under test goes to stderr so stdout stays valid JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run(args)
+    if output == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {output}", file=sys.stderr)
+    if baseline is not None:
+        print_comparison(compare(baseline, report), baseline["meta"].get("commit"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+import random
+
+VOCABULARY = ("linear regression logistic classification gradient descent learning rate cost function "
+              "hypothesis parameter feature vector matrix normal equation regularization overfitting "
+              "bias variance neural network activation sigmoid softmax backpropagation kernel support "
+              "vector machine margin clustering kmeans principal component analysis eigenvector "
+              "likelihood probability bayes naive generative discriminative training validation test").split()
+LINES_PER_PAGE = 45
+WORDS_PER_LINE = 12
+
+
+def _page_lines(rng):
+    return [" ".join(rng.choice(VOCABULARY) for _ in range(WORDS_PER_LINE)) for _ in range(LINES_PER_PAGE)]
+
+
+def write_synthetic_pdf(path, num_pages, seed = 0):
+    # minimal single-font PDF with deterministic pseudo-text, readable by pypdf
+    rng = random.Random(seed)
+    objects = []
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    catalog = add(None)
+    pages = add(None)
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    page_ids = []
+    for page_number in range(num_pages):
+        lines = [f"Synthetic chapter {page_number // 10 + 1}, page {page_number + 1}"] + _page_lines(rng)
+        text = "BT /F1 10 Tf 14 TL 50 800 Td " + " ".join(f"({line}) '" for line in lines) + " ET"
+        stream = text.encode("latin-1")
+        content = add(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        page_ids.append(add(b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] "
+                            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>" % (pages, font, content)))
+    objects[catalog - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % pages
+    objects[pages - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % page_id for page_id in page_ids), len(page_ids))
+
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(f.tell())
+            f.write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+        xref = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        for offset in offsets:
+            f.write(b"%010d 00000 n \n" % offset)
+        f.write(b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, xref))
+    return path
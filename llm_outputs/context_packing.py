@@ -0,0 +1,85 @@
+import re
+
+# prompt tokens available for retrieved context; ollama's default num_ctx is 2048,
+# which also has to hold the instructions and the answer
+MODEL_CONTEXT_BUDGETS = {
+    "phi3:mini": 1500,
+    "qwen2.5:1.5b": 1500,
+}
+DEFAULT_CONTEXT_BUDGET = 1500
+MAX_OVERLAP_CHARS = 400
+# shorter suffix/prefix matches are coincidence, not the splitter's chunk_overlap
+MIN_OVERLAP_CHARS = 20
+
+_chunk_number = re.compile(r"-(\d+)$")
+
+
+def count_tokens(text):
+    # rough estimate for English text with phi3/llama style tokenizers
+    return len(text) // 4 + 1
+
+
+def context_budget(model_name):
+    return MODEL_CONTEXT_BUDGETS.get(model_name, DEFAULT_CONTEXT_BUDGET)
+
+
+def _position(doc, rank):
+    # order within a document: splitter start offset if recorded, else the chunk number in the id
+    if "start_index" in doc.metadata:
+        return doc.metadata["start_index"]
+    match = _chunk_number.search(doc.id or "")
+    return int(match.group(1)) if match else rank
+
+
+def _overlap(previous, text):
+    # longest suffix of previous that is a prefix of text (the splitter's chunk_overlap)
+    for size in range(min(len(previous), len(text), MAX_OVERLAP_CHARS), MIN_OVERLAP_CHARS - 1, -1):
+        if previous.endswith(text[:size]):
+            return size
+    return 0
+
+
+def _adjacent(previous, previous_position, doc, position):
+    # the next chunk of the same page: by splitter offset when recorded, else by chunk number
+    if "start_index" in previous.metadata and "start_index" in doc.metadata:
+        return previous_position < position <= previous_position + len(previous.page_content)
+    return _chunk_number.search(doc.id or "") is not None and position == previous_position + 1
+
+
+def _merge(selected):
+    ordered = sorted(selected, key=lambda item: (item[1].metadata.get("source", ""), item[1].metadata.get("page", 0), item[2]))
+    passages = []
+    last = None
+    for _, doc, position in ordered:
+        key = (doc.metadata.get("source"), doc.metadata.get("page"))
+        text = doc.page_content
+        if last is not None and key == last[0] and key != (None, None) and _adjacent(last[1], last[2], doc, position):
+            overlap = _overlap(passages[-1], text)
+            passages[-1] += text[overlap:] if overlap else "\n" + text
+        else:
+            passages.append(text)
+        last = (key, doc, position)
+    return "\n\n".join(passages)
+
+
+def pack_context(retrieved_docs, token_budget = DEFAULT_CONTEXT_BUDGET):
+    # Adds chunks in retrieval rank order while the packed text fits the budget. Exact duplicates
+    # are dropped and neighbouring chunks of the same page are merged without their shared overlap,
+    # so the saved tokens go to further chunks instead.
+    selected = []
+    seen = set()
+    packed = ""
+    for rank, doc in enumerate(retrieved_docs):
+        key = doc.id or doc.page_content
+        if key in seen:
+            continue
+        seen.add(key)
+        candidate = _merge(selected + [(rank, doc, _position(doc, rank))])
+        if count_tokens(candidate) > token_budget:
+            if not selected:
+                # a single oversized chunk is truncated rather than dropped
+                return doc.page_content[:token_budget * 4]
+            continue
+        selected.append((rank, doc, _position(doc, rank)))
+        packed = candidate
+    return packed
@@ -0,0 +1,202 @@
+import json
+from typing import get_args, get_origin
+
+from pydantic import BaseModel
+
+
+def list_field(model):
+    # the one List[BaseModel] field of a structured output (Quiz.quiz, Concepts.concepts, RootNode.children)
+    for name, field in model.model_fields.items():
+        args = get_args(field.annotation)
+        if get_origin(field.annotation) is list and args and isinstance(args[0], type) and issubclass(args[0], BaseModel):
+            return name, args[0]
+    raise ValueError(f"{model.__name__} has no list of sub-models to stream")
+
+
+def item_label(item):
+    # first field (question, concept, node) identifies an item when merging a re-requested tail
+    value = getattr(item, next(iter(type(item).model_fields)))
+    return value.strip().lower() if isinstance(value, str) else value
+
+
+class StructuredStreamParser:
+    # Incremental scanner for one JSON object of `model`. It tracks strings, nesting and the
+    # top-level keys as text arrives, validates each element of the list field as soon as its
+    # closing brace arrives, and keeps the top-level scalars (e.g. RootNode.root). A response
+    # that never closes, or has a broken element, still yields every element that validated.
+    def __init__(self, model):
+        self.model = model
+        self.list_field, self.item_model = list_field(model)
+        self.items = []
+        self.fields = {}
+        self.invalid = 0
+        self.complete = False
+        self._labels = set()
+        self._result = None
+        self._text = ""
+        self._pos = 0
+        self._start = None
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._expect_key = False
+        self._key_start = None
+        self._key = None
+        self._awaiting_value = False
+        self._value_start = None
+        self._value_depth = None
+        self._in_list = False
+        self._item_start = None
+        self._closed = False
+
+    def feed(self, text):
+        # returns the items that became valid with this piece of text
+        self._text += text
+        new_items = []
+        text = self._text
+        for i in range(self._pos, len(text)):
+            if self._closed:
+                break
+            c = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._key_start is not None:
+                        self._key = self._loads(text[self._key_start:i + 1])
+                        self._key_start = None
+                    elif self._value_start is not None and self._value_depth is None:
+                        self._finish_value(text, i + 1)
+                continue
+            if self._start is None:
+                if c == "{":
+                    self._start = i
+                    self._depth = 1
+                    self._expect_key = True
+                continue
+            if c in " \t\r\n":
+                continue
+
+            if self._depth == 1 and self._awaiting_value:
+                self._awaiting_value = False
+                if c == "[" and self._key == self.list_field:
+                    self._in_list = True
+                else:
+                    self._value_start = i
+                    self._value_depth = 1 if c in "{[" else None
+
+            if c == '"':
+                self._in_string = True
+                if self._depth == 1 and self._expect_key:
+                    self._key_start = i
+                    self._expect_key = False
+            elif c in "{[":
+                if self._in_list and self._depth == 2 and c == "{":
+                    self._item_start = i
+                self._depth += 1
+            elif c in "}]":
+                if self._depth == 1 and self._value_start is not None and self._value_depth is None:
+                    self._finish_value(text, i)
+                self._depth -= 1
+                if self._depth == 0:
+                    self._finish_document(text, i + 1)
+                elif self._depth == 2 and self._item_start is not None:
+                    item = self._validate_item(text[self._item_start:i + 1])
+                    self._item_start = None
+                    if item is not None and self._add(item):
+                        new_items.append(item)
+                elif self._depth == 1:
+                    if self._value_depth is not None:
+                        self._finish_value(text, i + 1)
+                    self._in_list = False
+            elif c == ":" and self._depth == 1:
+                self._awaiting_value = True
+            elif c == "," and self._depth == 1:
+                if self._value_start is not None and self._value_depth is None:
+                    self._finish_value(text, i)
+                self._expect_key = True
+        self._pos = len(text)
+        return new_items
+
+    def close(self):
+        # end of stream; anything still open is what a tail request has to supply
+        self._closed = True
+        return self.result()
+
+    @staticmethod
+    def _loads(text):
+        try:
+            return json.loads(text)
+        except ValueError:
+            return None
+
+    def _finish_value(self, text, end):
+        value = self._loads(text[self._value_start:end].strip())
+        if value is not None and self._key is not None:
+            self.fields[self._key] = value
+        self._value_start = None
+        self._value_depth = None
+
+    def _finish_document(self, text, end):
+        self._closed = True
+        try:
+            self._result = self.model.model_validate_json(text[self._start:end])
+        except ValueError:
+            return
+        self.complete = True
+        for item in getattr(self._result, self.list_field):
+            self._add(item)
+
+    def _validate_item(self, text):
+        try:
+            return self.item_model.model_validate_json(text)
+        except ValueError:
+            self.invalid += 1
+            return None
+
+    def _add(self, item):
+        label = item_label(item)
+        if label in self._labels:
+            return False
+        self._labels.add(label)
+        self.items.append(item)
+        return True
+
+    def labels(self):
+        return [str(getattr(item, next(iter(type(item).model_fields)))) for item in self.items]
+
+    def merge_item(self, item):
+        # True when the item is new (not a repeat of one already received)
+        return self._add(item)
+
+    def merge(self, other):
+        # folds in the parse of a re-requested tail: new items are appended, fields only fill gaps
+        added = [item for item in other.items if self._add(item)]
+        for key, value in other.fields.items():
+            self.fields.setdefault(key, value)
+        if other.complete:
+            self.complete = True
+            self._result = None
+        return added
+
+    def result(self):
+        if self._result is not None:
+            return self._result
+        if not self.items:
+            return None
+        data = {key: value for key, value in self.fields.items() if key != self.list_field}
+        data[self.list_field] = [item.model_dump() for item in self.items]
+        try:
+            return self.model.model_validate(data)
+        except ValueError:
+            return None
+
+
+def parse_structured(model, text):
+    # full validation when the text is a well-formed object, otherwise whatever can be salvaged
+    parser = StructuredStreamParser(model)
+    parser.feed(text)
+    return parser.close()
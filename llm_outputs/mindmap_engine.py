@@ -0,0 +1,150 @@
+import contextvars
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List
+
+from pydantic import BaseModel, Field
+
+from llm_outputs.json_stream import parse_structured
+from llm_outputs.model_invoke import Concepts, Node, RootNode, _chat
+
+MINDMAP_MAX_WORKERS = 4
+SUBTREE_CACHE_SIZE = 512
+
+
+class Branch(BaseModel):
+    node: str = Field(description="The top-level concept of this branch")
+    description: str = Field(description="The description of the branch")
+    concepts: List[str] = Field(description="Names of the given concepts that belong under this branch")
+
+class Branches(BaseModel):
+    root: str = Field(description="The root of the mindmap")
+    description: str = Field(description="The description of the root")
+    branches: List[Branch] = Field(description="The top-level branches of the mindmap")
+
+
+def _concept_lines(concepts):
+    return "\n".join(json.dumps({"concept": concept.concept, "definition": concept.definition}) for concept in concepts)
+
+def _branches_request(topic, concepts: Concepts):
+    system_prompt = f"""You are a helpful assistant that plans mindmaps. The mindmap topic is: {topic}. Choose the root and 3 to 6 top-level branches for a mindmap of the given concepts.
+    - The concepts are given in curly brackets
+    - root is the main concept, branches are the broad groups below it
+    - Every given concept name must be listed under exactly one branch
+    - Do NOT hallucinate
+    - Do NOT create any concepts not provided
+
+    Here are the concepts:
+    {_concept_lines(concepts.concepts)}"""
+
+    options = {'temperature': 0.8}
+    return dict(messages = [
+        {
+            "role": "system",
+            "content": system_prompt
+        }
+    ], options = options, format=Branches.model_json_schema())
+
+def _subtree_request(branch: Branch, concepts):
+    system_prompt = f"""You are a helpful assistant that generates one branch of a mindmap in the form of a TREE. The branch is: {branch.node} ({branch.description}).
+    - The concepts are given in curly brackets
+    - The top node MUST be the branch itself: {branch.node}
+    - ONLY REARRANGE THIS CONCEPTS INTO A TREE BELOW THE BRANCH, DO NOT CREATE NEW CONCEPTS
+    - node is the concept name
+    - description is the concept definition
+    - children is the list of child concepts
+    - Do NOT hallucinate
+
+    Here are the concepts of this branch:
+    {_concept_lines(concepts)}"""
+
+    options = {'temperature': 0.8}
+    return dict(messages = [
+        {
+            "role": "system",
+            "content": system_prompt
+        }
+    ], options = options, format=Node.model_json_schema())
+
+
+def _parse(model):
+    # a truncated or partly malformed response keeps the branches/children that validated
+    def parse(response):
+        return parse_structured(model, response)
+    return parse
+
+
+def _fallback_branches(topic, concepts: Concepts):
+    # one branch per concept, so a failed planning call still yields a usable map
+    return Branches(root=topic, description=topic, branches=[
+        Branch(node=concept.concept, description=concept.definition, concepts=[concept.concept])
+        for concept in concepts.concepts])
+
+
+def select_branches(topic, concepts: Concepts):
+    branches = _chat(_branches_request(topic, concepts), "mindmap", [topic, concepts.model_dump_json()], parse=_parse(Branches))
+    if branches is None:
+        return _fallback_branches(topic, concepts)
+    # concepts the model left out become branches of their own
+    assigned = {name for branch in branches.branches for name in branch.concepts} | {branch.node for branch in branches.branches}
+    for concept in concepts.concepts:
+        if concept.concept not in assigned and concept.concept != branches.root:
+            branches.branches.append(Branch(node=concept.concept, description=concept.definition, concepts=[concept.concept]))
+    return branches
+
+
+_subtrees = OrderedDict()
+_subtrees_lock = threading.Lock()
+
+def expand_branch(branch: Branch, concepts: Concepts):
+    # subtrees are cached by the branch and its concepts, so regenerating a topic only
+    # re-expands branches whose content changed
+    by_name = {concept.concept: concept for concept in concepts.concepts}
+    members = [by_name[name] for name in branch.concepts if name in by_name and name != branch.node]
+    key = hashlib.sha256(json.dumps([branch.model_dump(), [m.model_dump() for m in members]], sort_keys=True).encode("utf-8")).hexdigest()
+    with _subtrees_lock:
+        if key in _subtrees:
+            _subtrees.move_to_end(key)
+            return _subtrees[key]
+
+    node = None
+    if members:
+        node = _chat(_subtree_request(branch, members), "mindmap", [key], parse=_parse(Node))
+    if node is None:
+        # keep the branch with its concepts as leaves instead of dropping it
+        node = Node(node=branch.node, description=branch.description, children=[
+            Node(node=m.concept, description=m.definition, children=[]) for m in members])
+    with _subtrees_lock:
+        _subtrees[key] = node
+        _subtrees.move_to_end(key)
+        if len(_subtrees) > SUBTREE_CACHE_SIZE:
+            _subtrees.popitem(last=False)
+    return node
+
+
+def iter_mindmap(topic, concepts: Concepts, max_workers = MINDMAP_MAX_WORKERS):
+    # yields ("root", number of branches, RootNode without children) first, then
+    # ("branch", position, Node) for each branch as soon as its subtree is expanded
+    branches = select_branches(topic, concepts)
+    yield "root", len(branches.branches), RootNode(root=branches.root, description=branches.description, children=[])
+    with ThreadPoolExecutor(max_workers) as pool:
+        # each branch runs in a copy of the caller's context so its spans join the caller's trace
+        futures = {pool.submit(contextvars.copy_context().run, expand_branch, branch, concepts): i
+                   for i, branch in enumerate(branches.branches)}
+        for future in as_completed(futures):
+            yield "branch", futures[future], future.result()
+
+
+def generate_mindmap_parallel(topic, concepts: Concepts, max_workers = MINDMAP_MAX_WORKERS):
+    root = None
+    children = {}
+    for kind, position, node in iter_mindmap(topic, concepts, max_workers):
+        if kind == "root":
+            root = node
+        else:
+            children[position] = node
+    root.children = [children[i] for i in sorted(children)]
+    return root
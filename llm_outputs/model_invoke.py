@@ -1,14 +1,54 @@
+import contextvars
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 # import langgraph
 # from langchain_community.chat_models import ChatOllama
 # import ollama
 from typing import TypedDict, List, Dict
 # from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
-from ollama import chat, ChatResponse
+from ollama import ChatResponse
 from langchain_core.documents import Document
 from pydantic import BaseModel, Field
 
+from llm_outputs.context_packing import context_budget, count_tokens, pack_context
+from llm_outputs.json_stream import StructuredStreamParser
+from llm_outputs.ollama_pool import BATCH, INTERACTIVE, scheduled_chat, scheduled_chat_stream, ascheduled_chat, ascheduled_chat_stream
+from observability.tracing import record, span, start_span, traced
+
 # MODEL_NAME = "qwen2.5:1.5b"
 MODEL_NAME = "phi3:mini"
+
+# optional llm_outputs.response_cache.ResponseCache, see set_response_cache
+response_cache = None
+
+# how much of an unparseable completion is kept on its trace span
+TRACE_RAW_CHARS = 4000
+# follow-up requests for the missing part of a truncated or malformed structured response
+MAX_TAIL_REQUESTS = 1
+# how the list items of each structured output are named in a tail request
+TAIL_ITEM_NAMES = {"quiz": "questions", "concepts": "concepts", "children": "branches"}
+
+# interactive answers are scheduled ahead of long batch generations
+TASK_PRIORITIES = {
+    "summary": INTERACTIVE,
+    "qna": INTERACTIVE,
+    "summary_map": BATCH,
+    "quiz": BATCH,
+    "concepts": BATCH,
+    "mindmap": BATCH,
+}
+
+# map-reduce summaries: prompt tokens per call, output tokens per partial summary
+MAP_REDUCE_TOKEN_BUDGET = context_budget(MODEL_NAME)
+MAP_REDUCE_SUMMARY_TOKENS = 256
+MAP_REDUCE_MAX_WORKERS = 4
+# every round at least halves the groups, so this is only a guard
+MAP_REDUCE_MAX_ROUNDS = 8
+PARTIAL_SUMMARY_CACHE_SIZE = 1024
 # llm = ChatOllama(model = MODEL_NAME, temperature = 0.7)
 
 
@@ -89,25 +129,26 @@ format_mindmap_example = """
 }
 """
 
-def model_invoke_summary(retrieved_docs):
+@traced("prompt.build", task="summary")
+def _summary_request(retrieved_docs):
     system_prompt = f"""You are a helpful assistant that summarizes long documents. Read the given text, and summarize accurately. Do not hallucinate. Do not give inconsistent summaries. Keep the summary concise and reflective of the given text. Give ONLY the summary. Here are retrieved chunks from the document: 
-    {" ".join([doc.page_content for doc in retrieved_docs])}"""
+    {pack_context(retrieved_docs, context_budget(MODEL_NAME))}"""
 
     options = {'temperature': 0.7}
-    response = chat(model=MODEL_NAME, messages = [
+    return dict(messages = [
         {
             "role": "system",
             "content": system_prompt
         }
     ], options = options)
-    return response.message.content
 
-def model_invoke_qna(query, retrieved_docs):
+@traced("prompt.build", task="qna")
+def _qna_request(query, retrieved_docs):
     system_prompt = f"""You are a helpful assistant that answers questions based on the given text. Read the given text, and answer the question accurately. Do not hallucinate. Do not give inconsistent answers. Give ONLY the answer. Here are retrieved chunks from the document: 
-    {" ".join([doc.page_content for doc in retrieved_docs])}"""
+    {pack_context(retrieved_docs, context_budget(MODEL_NAME))}"""
 
     options = {'temperature': 0.7}
-    response = chat(model=MODEL_NAME, messages = [
+    return dict(messages = [
         {
             "role": "system",
             "content": system_prompt
@@ -117,29 +158,24 @@ def model_invoke_qna(query, retrieved_docs):
             "content": query
         }
     ], options = options)
-    return response.message.content
 
-def model_invoke_generate_quiz(topic, retrieved_docs):
+@traced("prompt.build", task="quiz")
+def _quiz_request(topic, retrieved_docs):
     system_prompt = f"""You are a helpful assistant that generates a quiz based on the given text. Read the given text, and generate a quiz accurately. Do not hallucinate. Make sure the quiz questions are related to the topic. Give ONLY the quiz. The quiz topic is: {topic}. Here are retrieved chunks from the document: 
-    {" ".join([doc.page_content for doc in retrieved_docs])}\n\n"""
+    {pack_context(retrieved_docs, context_budget(MODEL_NAME))}\n\n"""
 
     options = {'temperature': 0.7}
-    response = chat(model=MODEL_NAME, messages = [
+    return dict(messages = [
         {
             "role": "system",
             "content": system_prompt
         }
     ], options = options, format=Quiz.model_json_schema())
-    response = response.message.content
-    try:
-        response = Quiz.parse_raw(response)
-    except:
-        response = None
-    return response
 
-def concept_extraction(retrieved_docs, format_example = format_concept_extraction_example):
+@traced("prompt.build", task="concepts")
+def _concept_request(retrieved_docs):
     system_prompt = f"""You are a helpful assistant that extracts concepts from the given text. Read the given text, and extract concepts ACCURATELY. Extract AS MANY topics as possible. Do not hallucinate. Do not give inconsistent concepts. Here are retrieved chunks from the document: 
-    {" ".join([doc.page_content for doc in retrieved_docs])}\n\n
+    {pack_context(retrieved_docs, context_budget(MODEL_NAME))}\n\n
 
     Rules:
     - Use plain ASCII characters only
@@ -150,28 +186,15 @@ def concept_extraction(retrieved_docs, format_example = format_concept_extractio
 
     # Only output in the given format. Do NOT give any other text other than the provided format:\n {format_example}"""
     options = {'temperature': 0.8}
-    response = chat(model=MODEL_NAME, messages = [
+    return dict(messages = [
         {
             "role": "system",
             "content": system_prompt
         }
     ], options = options, format=Concepts.model_json_schema(),)
 
-    response = response.message.content
-    # response = """{"concepts": """ + response + "}"
-    # validate, dont return
-    
-    print("CONCEPTS RAW ===========================================================================")
-    print(response)
-    print("=======================================================================================")
-    
-    try:
-        response = Concepts.parse_raw(response)
-    except:
-        return None
-    return response
-
-def generate_mindmap(concepts: Concepts, format_example = format_mindmap_example):
+@traced("prompt.build", task="mindmap")
+def _mindmap_request(concepts: Concepts):
     # only output in the given format to be read by pydantic model
 
     concept_string = "\n".join(["{\"concept\": \"" + concept.concept + "\", \"definition\": \"" + concept.definition + "\"}" for concept in concepts.concepts])
@@ -189,25 +212,392 @@ def generate_mindmap(concepts: Concepts, format_example = format_mindmap_example
     {concept_string}"""
 
     options = {'temperature': 0.8}
-    response = chat(model=MODEL_NAME, messages = [
+    return dict(messages = [
         {
             "role": "system",
             "content": system_prompt
         }
     ], options = options, format=RootNode.model_json_schema())
 
-    response = response.message.content
-
-    print("MINDMAP RAW ===========================================================================")
-    print(response)
-    print("=======================================================================================")
-    # validate, dont return
-    
+def set_response_cache(cache):
+    global response_cache
+    response_cache = cache
+
+def _sources(retrieved_docs):
+    # chunk ids are derived from the document content hash, so they fingerprint the index too
+    return [doc.id or hashlib.sha256(doc.page_content.encode("utf-8")).hexdigest() for doc in retrieved_docs]
+
+def _prompt_digest(request, query):
+    # chunk ids do not change with chunk_size/overlap or a prompt edit, so the prompt text itself
+    # is part of the context; the query is left out so paraphrases still share a context
+    messages = [dict(message, content=message["content"].replace(query, "") if query else message["content"])
+                for message in request["messages"]]
+    return hashlib.sha256(json.dumps([messages, request.get("format")], sort_keys=True).encode("utf-8")).hexdigest()
+
+def _cache_context(task, request, sources, query = ""):
+    return {"task": task, "model": MODEL_NAME, "options": request.get("options"),
+            "structured": "format" in request, "sources": sources, "prompt": _prompt_digest(request, query)}
+
+def _ollama_timings(response):
+    # the final response carries ollama's own timings, in nanoseconds: prompt evaluation
+    # (prefill) and generation are reported separately
+    timings = {}
+    for field in ("prompt_eval_count", "eval_count"):
+        if getattr(response, field, None) is not None:
+            timings[field] = getattr(response, field)
+    for field in ("load_duration", "prompt_eval_duration", "eval_duration", "total_duration"):
+        if getattr(response, field, None) is not None:
+            timings[field.replace("duration", "ms")] = getattr(response, field) / 1e6
+    return timings
+
+def _parse(parse, content, task):
+    with span("llm.parse", task=task, chars=len(content)) as parse_span:
+        result = parse(content)
+        parse_span.set(valid=result is not None)
+        if result is None:
+            parse_span.set(raw=content[:TRACE_RAW_CHARS])
+    return result
+
+def _chat(request, task, sources, query = "", parse = None):
+    with span("llm.request", task=task) as request_span:
+        context = _cache_context(task, request, sources, query)
+        content = response_cache.get(context, query) if response_cache is not None else None
+        if content is not None:
+            request_span.set(cache="hit")
+            return _parse(parse, content, task) if parse else content
+
+        with span("ollama.chat", task=task, model=MODEL_NAME) as call_span:
+            response = scheduled_chat(TASK_PRIORITIES.get(task, BATCH), model=MODEL_NAME, **request)
+            call_span.set(**_ollama_timings(response))
+        content = response.message.content
+        result = _parse(parse, content, task) if parse else content
+        # never cache a structured response that failed to parse
+        if response_cache is not None and result is not None:
+            response_cache.put(context, query, content)
+        return result
+
+def _stream_pieces(request, task):
+    # yields the completion piece by piece as ollama produces it; the span is not made
+    # current because the caller runs between pieces
+    call_span = start_span("ollama.chat_stream", task=task, model=MODEL_NAME)
     try:
-        response = RootNode.parse_raw(response)
-    except:
-        return None
-    return response
+        start = time.perf_counter()
+        first = True
+        for part in scheduled_chat_stream(TASK_PRIORITIES.get(task, BATCH), model=MODEL_NAME, **request):
+            if part.message.content:
+                if first:
+                    call_span.set(first_piece_ms=(time.perf_counter() - start) * 1000)
+                    first = False
+                yield part.message.content
+            if part.done:
+                call_span.set(**_ollama_timings(part))
+    finally:
+        call_span.end()
+
+def _chat_stream(request, task, sources, query = ""):
+    context = _cache_context(task, request, sources, query)
+    cached = response_cache.get(context, query) if response_cache is not None else None
+    if cached is not None:
+        yield cached
+        return
+
+    pieces = []
+    for piece in _stream_pieces(request, task):
+        pieces.append(piece)
+        yield piece
+    if response_cache is not None:
+        response_cache.put(context, query, "".join(pieces))
+
+def _tail_request(request, parser):
+    # asks only for the list items that are still missing, naming the ones already received
+    done = "; ".join(parser.labels())
+    items = TAIL_ITEM_NAMES.get(parser.list_field, parser.list_field)
+    return dict(request, messages = request["messages"] + [
+        {
+            "role": "user",
+            "content": f"Your previous answer was cut off. These {items} are already done: {done}. "
+                       f"Give ONLY the remaining {items} in the same JSON format, without repeating any of the ones already done."
+        }
+    ])
+
+def _stream_structured(parser, request, task, sources, query = ""):
+    # yields each list item (question, concept, top-level subtree) as soon as it validates;
+    # parser.result() is the final object afterwards. A truncated or malformed response keeps
+    # its valid items and only the missing tail is requested again.
+    context = _cache_context(task, request, sources, query)
+    cached = response_cache.get(context, query) if response_cache is not None else None
+    parse_seconds = 0.0
+    if cached is not None:
+        yield from parser.feed(cached)
+        parser.close()
+        if parser.complete:
+            return
+    else:
+        for piece in _stream_pieces(request, task):
+            start = time.perf_counter()
+            items = parser.feed(piece)
+            parse_seconds += time.perf_counter() - start
+            yield from items
+        parser.close()
+
+    tail_requests = 0
+    while not parser.complete and tail_requests < MAX_TAIL_REQUESTS:
+        tail_requests += 1
+        tail = StructuredStreamParser(parser.model)
+        for piece in _stream_pieces(_tail_request(request, parser), task):
+            start = time.perf_counter()
+            items = [item for item in tail.feed(piece) if parser.merge_item(item)]
+            parse_seconds += time.perf_counter() - start
+            yield from items
+        tail.close()
+        parser.merge(tail)
+
+    result = parser.result()
+    record("llm.parse", parse_seconds * 1000, task=task, items=len(parser.items), invalid=parser.invalid,
+           complete=parser.complete, tail_requests=tail_requests)
+    # only complete results are cached, a salvaged partial one is retried next time
+    if response_cache is not None and result is not None and parser.complete:
+        response_cache.put(context, query, result.model_dump_json())
+
+async def _achat(request, task, sources, query = "", parse = None):
+    with span("llm.request", task=task) as request_span:
+        context = _cache_context(task, request, sources, query)
+        content = response_cache.get(context, query) if response_cache is not None else None
+        if content is not None:
+            request_span.set(cache="hit")
+            return _parse(parse, content, task) if parse else content
+
+        with span("ollama.chat", task=task, model=MODEL_NAME) as call_span:
+            response = await ascheduled_chat(TASK_PRIORITIES.get(task, BATCH), model=MODEL_NAME, **request)
+            call_span.set(**_ollama_timings(response))
+        content = response.message.content
+        result = _parse(parse, content, task) if parse else content
+        if response_cache is not None and result is not None:
+            response_cache.put(context, query, content)
+        return result
+
+async def _astream_pieces(request, task):
+    call_span = start_span("ollama.chat_stream", task=task, model=MODEL_NAME)
+    try:
+        start = time.perf_counter()
+        first = True
+        async for part in ascheduled_chat_stream(TASK_PRIORITIES.get(task, BATCH), model=MODEL_NAME, **request):
+            if part.message.content:
+                if first:
+                    call_span.set(first_piece_ms=(time.perf_counter() - start) * 1000)
+                    first = False
+                yield part.message.content
+            if part.done:
+                call_span.set(**_ollama_timings(part))
+    finally:
+        call_span.end()
+
+async def _achat_stream(request, task, sources, query = ""):
+    context = _cache_context(task, request, sources, query)
+    cached = response_cache.get(context, query) if response_cache is not None else None
+    if cached is not None:
+        yield cached
+        return
+
+    pieces = []
+    async for piece in _astream_pieces(request, task):
+        pieces.append(piece)
+        yield piece
+    if response_cache is not None:
+        response_cache.put(context, query, "".join(pieces))
+
+async def _astream_structured(parser, request, task, sources, query = ""):
+    context = _cache_context(task, request, sources, query)
+    cached = response_cache.get(context, query) if response_cache is not None else None
+    parse_seconds = 0.0
+    if cached is not None:
+        for item in parser.feed(cached):
+            yield item
+        parser.close()
+        if parser.complete:
+            return
+    else:
+        async for piece in _astream_pieces(request, task):
+            start = time.perf_counter()
+            items = parser.feed(piece)
+            parse_seconds += time.perf_counter() - start
+            for item in items:
+                yield item
+        parser.close()
+
+    tail_requests = 0
+    while not parser.complete and tail_requests < MAX_TAIL_REQUESTS:
+        tail_requests += 1
+        tail = StructuredStreamParser(parser.model)
+        async for piece in _astream_pieces(_tail_request(request, parser), task):
+            start = time.perf_counter()
+            items = [item for item in tail.feed(piece) if parser.merge_item(item)]
+            parse_seconds += time.perf_counter() - start
+            for item in items:
+                yield item
+        tail.close()
+        parser.merge(tail)
+
+    result = parser.result()
+    record("llm.parse", parse_seconds * 1000, task=task, items=len(parser.items), invalid=parser.invalid,
+           complete=parser.complete, tail_requests=tail_requests)
+    if response_cache is not None and result is not None and parser.complete:
+        response_cache.put(context, query, result.model_dump_json())
+
+def _structured(parser, items):
+    for _ in items:
+        pass
+    return parser.result()
+
+async def _astructured(parser, items):
+    async for _ in items:
+        pass
+    return parser.result()
+
+
+def model_invoke_summary(retrieved_docs):
+    return _chat(_summary_request(retrieved_docs), "summary", _sources(retrieved_docs))
+
+def model_invoke_qna(query, retrieved_docs):
+    return _chat(_qna_request(query, retrieved_docs), "qna", _sources(retrieved_docs), query)
+
+def model_invoke_generate_quiz(topic, retrieved_docs):
+    parser = StructuredStreamParser(Quiz)
+    return _structured(parser, _stream_structured(parser, _quiz_request(topic, retrieved_docs), "quiz", _sources(retrieved_docs), topic))
+
+def concept_extraction(retrieved_docs, format_example = format_concept_extraction_example):
+    parser = StructuredStreamParser(Concepts)
+    return _structured(parser, _stream_structured(parser, _concept_request(retrieved_docs), "concepts", _sources(retrieved_docs)))
+
+def generate_mindmap(concepts: Concepts, format_example = format_mindmap_example):
+    parser = StructuredStreamParser(RootNode)
+    return _structured(parser, _stream_structured(parser, _mindmap_request(concepts), "mindmap", [concepts.model_dump_json()]))
+
+
+# streaming variants: generators of text pieces, e.g. for st.write_stream
+def model_invoke_summary_stream(retrieved_docs):
+    return _chat_stream(_summary_request(retrieved_docs), "summary", _sources(retrieved_docs))
+
+def model_invoke_qna_stream(query, retrieved_docs):
+    return _chat_stream(_qna_request(query, retrieved_docs), "qna", _sources(retrieved_docs), query)
+
+# structured streaming variants: generators of validated Question_Answer / Concept / top-level Node items
+def model_invoke_generate_quiz_stream(topic, retrieved_docs):
+    return _stream_structured(StructuredStreamParser(Quiz), _quiz_request(topic, retrieved_docs), "quiz", _sources(retrieved_docs), topic)
+
+def concept_extraction_stream(retrieved_docs):
+    return _stream_structured(StructuredStreamParser(Concepts), _concept_request(retrieved_docs), "concepts", _sources(retrieved_docs))
+
+def generate_mindmap_stream(concepts: Concepts):
+    return _stream_structured(StructuredStreamParser(RootNode), _mindmap_request(concepts), "mindmap", [concepts.model_dump_json()])
+
+
+# async variants
+async def amodel_invoke_summary(retrieved_docs):
+    return await _achat(_summary_request(retrieved_docs), "summary", _sources(retrieved_docs))
+
+async def amodel_invoke_qna(query, retrieved_docs):
+    return await _achat(_qna_request(query, retrieved_docs), "qna", _sources(retrieved_docs), query)
+
+async def amodel_invoke_generate_quiz(topic, retrieved_docs):
+    parser = StructuredStreamParser(Quiz)
+    return await _astructured(parser, _astream_structured(parser, _quiz_request(topic, retrieved_docs), "quiz", _sources(retrieved_docs), topic))
+
+async def aconcept_extraction(retrieved_docs, format_example = format_concept_extraction_example):
+    parser = StructuredStreamParser(Concepts)
+    return await _astructured(parser, _astream_structured(parser, _concept_request(retrieved_docs), "concepts", _sources(retrieved_docs)))
+
+async def agenerate_mindmap(concepts: Concepts, format_example = format_mindmap_example):
+    parser = StructuredStreamParser(RootNode)
+    return await _astructured(parser, _astream_structured(parser, _mindmap_request(concepts), "mindmap", [concepts.model_dump_json()]))
+
+def amodel_invoke_summary_stream(retrieved_docs):
+    return _achat_stream(_summary_request(retrieved_docs), "summary", _sources(retrieved_docs))
+
+def amodel_invoke_qna_stream(query, retrieved_docs):
+    return _achat_stream(_qna_request(query, retrieved_docs), "qna", _sources(retrieved_docs), query)
+
+
+def _group_by_budget(texts, token_budget):
+    groups = [[]]
+    used = 0
+    for text in texts:
+        # +1 for the separator pack_context puts between passages
+        tokens = count_tokens(text) + 1
+        if tokens > token_budget:
+            text = text[:(token_budget - 2) * 4]
+            tokens = token_budget
+        if groups[-1] and used + tokens > token_budget:
+            groups.append([])
+            used = 0
+        groups[-1].append(text)
+        used += tokens
+    return groups
+
+@traced("prompt.build", task="summary_map")
+def _partial_summary_request(texts, summary_tokens):
+    system_prompt = f"""You are a helpful assistant that summarizes one section of a long document. Read the given text, and summarize it accurately. Do not hallucinate. Keep every key concept, definition and result. Give ONLY the summary. Here is the section: 
+    {" ".join(texts)}"""
+
+    options = {'temperature': 0.7, 'num_predict': summary_tokens}
+    return dict(messages = [
+        {
+            "role": "system",
+            "content": system_prompt
+        }
+    ], options = options)
+
+_partial_summaries = OrderedDict()
+_partial_summaries_lock = threading.Lock()
+
+def _partial_summary(texts, summary_tokens):
+    # partial summaries are cached in-process (and in response_cache when installed),
+    # so re-summarizing a document only pays for groups that changed
+    key = hashlib.sha256(("\0".join(texts) + str(summary_tokens)).encode("utf-8")).hexdigest()
+    with _partial_summaries_lock:
+        if key in _partial_summaries:
+            _partial_summaries.move_to_end(key)
+            return _partial_summaries[key]
+    summary = _chat(_partial_summary_request(texts, summary_tokens), "summary_map", [key])
+    # num_predict is only a hint and token counts are estimates, so cut the partial to one
+    # token less than summary_tokens: with the separator, two partials always share a group
+    summary = summary[:max(1, summary_tokens - 2) * 4]
+    with _partial_summaries_lock:
+        _partial_summaries[key] = summary
+        _partial_summaries.move_to_end(key)
+        if len(_partial_summaries) > PARTIAL_SUMMARY_CACHE_SIZE:
+            _partial_summaries.popitem(last=False)
+    return summary
+
+def model_invoke_summary_map_reduce(retrieved_docs, token_budget = MAP_REDUCE_TOKEN_BUDGET, summary_tokens = MAP_REDUCE_SUMMARY_TOKENS,
+                                    max_workers = MAP_REDUCE_MAX_WORKERS, progress = None, max_rounds = MAP_REDUCE_MAX_ROUNDS):
+    # summarize groups of chunks that fit the budget concurrently, then summarize the summaries
+    # until everything fits into one final call
+    if summary_tokens * 2 > token_budget:
+        raise ValueError("summary_tokens must be at most half of token_budget for the reduction to converge")
+    with span("llm.map_reduce", chunks=len(retrieved_docs)) as map_reduce_span:
+        texts = [doc.page_content for doc in retrieved_docs]
+        groups = _group_by_budget(texts, token_budget)
+        rounds = 0
+        # workers run in a copy of this context so their spans join the caller's trace
+        context = contextvars.copy_context()
+        with ThreadPoolExecutor(max_workers) as pool:
+            while len(groups) > 1:
+                rounds += 1
+                partials = []
+                for summary in pool.map(lambda group: context.copy().run(_partial_summary, group, summary_tokens), groups):
+                    partials.append(summary)
+                    if progress:
+                        progress(len(partials), len(groups))
+                reduced = _group_by_budget(partials, token_budget)
+                if len(reduced) >= len(groups) or (len(reduced) > 1 and rounds >= max_rounds):
+                    # no progress or out of rounds: the final prompt's packing keeps what fits
+                    map_reduce_span.set(forced_merge=True)
+                    reduced = [partials]
+                groups = reduced
+        map_reduce_span.set(rounds=rounds)
+        final_docs = [Document(page_content=text) for text in groups[0]]
+        return _chat(_summary_request(final_docs), "summary", _sources(final_docs))
 
 
 if __name__ == "__main__":
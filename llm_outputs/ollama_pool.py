@@ -0,0 +1,222 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import httpx
+from ollama import AsyncClient, Client
+
+OLLAMA_HOST = os.environ.get("OLLAMA_HOST", "http://127.0.0.1:11434")
+MAX_CONCURRENT_REQUESTS = int(os.environ.get("OLLAMA_MAX_CONCURRENT", "2"))
+# how long ollama keeps the model resident after a request (ollama's own default is 5m)
+KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+MAX_CONNECTIONS = 8
+DEFAULT_TIMEOUT = 120.0
+WAIT_SAMPLES = 1000
+
+# lower value is served first
+INTERACTIVE = 0
+BATCH = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+# lowest priority any call in the current context may use, see priority_floor
+_priority_floor = contextvars.ContextVar("ollama_priority_floor", default=INTERACTIVE)
+
+
+class PriorityLimiter:
+    # Counting semaphore whose waiters are admitted by (priority, arrival order), so queued
+    # interactive requests always go ahead of queued batch ones.
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self._waiters = []
+        self._order = itertools.count()
+        self._cond = threading.Condition()
+        self._waits = {priority: deque(maxlen=WAIT_SAMPLES) for priority in PRIORITY_NAMES}
+        self._timeouts = 0
+
+    def acquire(self, priority = INTERACTIVE, timeout = None, abandoned = None):
+        # abandoned: optional threading.Event; once set (see abandon) the waiter leaves the
+        # queue and acquire returns False without taking a slot
+        entry = (priority, next(self._order))
+        start = time.monotonic()
+        with self._cond:
+            heapq.heappush(self._waiters, entry)
+            while self.active >= self.limit or self._waiters[0] != entry:
+                if abandoned is not None and abandoned.is_set():
+                    self._leave(entry)
+                    return False
+                remaining = None if timeout is None else timeout - (time.monotonic() - start)
+                if remaining is not None and remaining <= 0:
+                    self._leave(entry)
+                    self._timeouts += 1
+                    raise TimeoutError(f"waited more than {timeout}s for an ollama slot")
+                self._cond.wait(remaining)
+            heapq.heappop(self._waiters)
+            self.active += 1
+            self._waits.setdefault(priority, deque(maxlen=WAIT_SAMPLES)).append(time.monotonic() - start)
+            self._cond.notify_all()
+            return True
+
+    def _leave(self, entry):
+        self._waiters.remove(entry)
+        heapq.heapify(self._waiters)
+        self._cond.notify_all()
+
+    def abandon(self, abandoned):
+        with self._cond:
+            abandoned.set()
+            self._cond.notify_all()
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+    def resize(self, limit):
+        with self._cond:
+            self.limit = limit
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, priority = INTERACTIVE, timeout = None):
+        self.acquire(priority, timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def metrics(self):
+        with self._cond:
+            waits = {}
+            for priority, samples in self._waits.items():
+                ordered = sorted(samples)
+                waits[PRIORITY_NAMES.get(priority, str(priority))] = {
+                    "count": len(ordered),
+                    "mean_s": sum(ordered) / len(ordered) if ordered else 0.0,
+                    # nearest rank, so a handful of samples does not report the minimum
+                    "p95_s": ordered[math.ceil(0.95 * len(ordered)) - 1] if ordered else 0.0,
+                    "max_s": ordered[-1] if ordered else 0.0,
+                }
+            return {
+                "limit": self.limit,
+                "active": self.active,
+                "queue_depth": len(self._waiters),
+                "queue_timeouts": self._timeouts,
+                "wait": waits,
+            }
+
+
+limiter = PriorityLimiter(MAX_CONCURRENT_REQUESTS)
+_host = OLLAMA_HOST
+_max_connections = MAX_CONNECTIONS
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def configure(host = None, max_concurrent = None, max_connections = None):
+    # e.g. configure(host=stub_url) to run against llm_outputs.stub_ollama
+    global _host, _max_connections
+    with _clients_lock:
+        if host is not None:
+            _host = host
+        if max_connections is not None:
+            _max_connections = max_connections
+        _clients.clear()
+    if max_concurrent is not None:
+        limiter.resize(max_concurrent)
+
+
+def get_client(timeout = DEFAULT_TIMEOUT):
+    # one pooled, keep-alive client per timeout value, shared by every session in the process
+    with _clients_lock:
+        client = _clients.get(timeout)
+        if client is None:
+            limits = httpx.Limits(max_connections=_max_connections, max_keepalive_connections=_max_connections)
+            client = Client(host=_host, timeout=timeout, limits=limits)
+            _clients[timeout] = client
+        return client
+
+
+@contextmanager
+def priority_floor(priority):
+    # e.g. the batch runner: every call made inside, including summaries and QnA, queues
+    # behind interactive requests from the app
+    token = _priority_floor.set(priority)
+    try:
+        yield
+    finally:
+        _priority_floor.reset(token)
+
+
+def _effective_priority(priority):
+    return max(priority, _priority_floor.get())
+
+
+def warm_up(model, keep_alive = KEEP_ALIVE, timeout = DEFAULT_TIMEOUT):
+    # an empty prompt only loads the model into memory; it bypasses the limiter because it
+    # generates nothing
+    return get_client(timeout).generate(model=model, prompt="", keep_alive=keep_alive)
+
+
+def scheduled_chat(priority = INTERACTIVE, timeout = DEFAULT_TIMEOUT, queue_timeout = None, **kwargs):
+    kwargs.setdefault("keep_alive", KEEP_ALIVE)
+    with limiter.slot(_effective_priority(priority), queue_timeout):
+        return get_client(timeout).chat(**kwargs)
+
+
+def scheduled_chat_stream(priority = INTERACTIVE, timeout = DEFAULT_TIMEOUT, queue_timeout = None, **kwargs):
+    # the slot is held until the stream is exhausted or closed
+    kwargs.setdefault("keep_alive", KEEP_ALIVE)
+    with limiter.slot(_effective_priority(priority), queue_timeout):
+        yield from get_client(timeout).chat(stream=True, **kwargs)
+
+
+async def _aacquire(priority, queue_timeout):
+    # the limiter is shared with the blocking callers, so the wait runs in a worker thread. If
+    # the waiting coroutine is cancelled (e.g. by asyncio.wait_for) the thread leaves the queue,
+    # and a slot it got in the meantime is handed straight back.
+    abandoned = threading.Event()
+    acquired = asyncio.get_running_loop().run_in_executor(None, limiter.acquire, _effective_priority(priority), queue_timeout, abandoned)
+    try:
+        await asyncio.shield(acquired)
+    except asyncio.CancelledError:
+        limiter.abandon(abandoned)
+        acquired.add_done_callback(_release_abandoned)
+        raise
+
+
+def _release_abandoned(acquired):
+    if not acquired.cancelled() and acquired.exception() is None and acquired.result():
+        limiter.release()
+
+
+async def ascheduled_chat(priority = INTERACTIVE, timeout = DEFAULT_TIMEOUT, queue_timeout = None, **kwargs):
+    kwargs.setdefault("keep_alive", KEEP_ALIVE)
+    await _aacquire(priority, queue_timeout)
+    try:
+        # httpx async clients are bound to an event loop, so each call opens and closes its own
+        async with AsyncClient(host=_host, timeout=timeout) as client:
+            return await client.chat(**kwargs)
+    finally:
+        limiter.release()
+
+
+async def ascheduled_chat_stream(priority = INTERACTIVE, timeout = DEFAULT_TIMEOUT, queue_timeout = None, **kwargs):
+    kwargs.setdefault("keep_alive", KEEP_ALIVE)
+    await _aacquire(priority, queue_timeout)
+    try:
+        async with AsyncClient(host=_host, timeout=timeout) as client:
+            async for part in await client.chat(stream=True, **kwargs):
+                yield part
+    finally:
+        limiter.release()
+
+
+def metrics():
+    return limiter.metrics()
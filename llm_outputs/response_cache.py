@@ -0,0 +1,118 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+RESPONSE_CACHE_PATH = os.path.abspath(os.path.join("llm_cache", "responses.sqlite"))
+RESPONSE_CACHE_TTL = 7 * 24 * 3600
+RESPONSE_CACHE_MAX_ENTRIES = 5000
+SIMILARITY_THRESHOLD = 0.92
+
+
+def digest(obj):
+    return hashlib.sha256(json.dumps(obj, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    # Exact lookups are keyed by (context, query). When an embedding model is given, a miss
+    # falls back to the most similar cached query under the same context, so paraphrased
+    # questions over the same retrieved chunks reuse the answer.
+    def __init__(self, path = RESPONSE_CACHE_PATH, ttl = RESPONSE_CACHE_TTL, max_entries = RESPONSE_CACHE_MAX_ENTRIES,
+                 embedding_model = None, similarity_threshold = SIMILARITY_THRESHOLD):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.embedding_model = embedding_model
+        self.similarity_threshold = similarity_threshold
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("""CREATE TABLE IF NOT EXISTS entries (
+            key TEXT PRIMARY KEY,
+            context_key TEXT NOT NULL,
+            query TEXT,
+            embedding BLOB,
+            response TEXT NOT NULL,
+            created REAL NOT NULL,
+            last_access REAL NOT NULL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_context ON entries (context_key)")
+        self._db.commit()
+
+    def _embed(self, query):
+        vector = np.asarray(self.embedding_model.embed_query(query), dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def get(self, context, query = ""):
+        key, context_key = digest([context, query]), digest(context)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT response, created FROM entries WHERE key = ?", (key,)).fetchone()
+            if row and now - row[1] <= self.ttl:
+                self._db.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+                self._db.commit()
+                self.hits += 1
+                return row[0]
+
+            if self.embedding_model is not None and query:
+                candidates = self._db.execute(
+                    "SELECT key, embedding, response FROM entries WHERE context_key = ? AND embedding IS NOT NULL AND created >= ?",
+                    (context_key, now - self.ttl)).fetchall()
+                if candidates:
+                    query_vector = self._embed(query)
+                    scores = [float(np.dot(query_vector, np.frombuffer(blob, dtype=np.float32))) for _, blob, _ in candidates]
+                    best = int(np.argmax(scores))
+                    if scores[best] >= self.similarity_threshold:
+                        self._db.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, candidates[best][0]))
+                        self._db.commit()
+                        self.semantic_hits += 1
+                        return candidates[best][2]
+
+            self.misses += 1
+            return None
+
+    def put(self, context, query, response):
+        key, context_key = digest([context, query]), digest(context)
+        embedding = None
+        if self.embedding_model is not None and query:
+            embedding = self._embed(query).tobytes()
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (key, context_key, query, embedding, response, created, last_access) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, context_key, query, embedding, response, now, now))
+            self._evict(now)
+            self._db.commit()
+
+    def _evict(self, now):
+        self._db.execute("DELETE FROM entries WHERE created < ?", (now - self.ttl,))
+        (count,) = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()
+        if count > self.max_entries:
+            self._db.execute(
+                "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY last_access ASC LIMIT ?)",
+                (count - self.max_entries,))
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM entries")
+            self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            (entries,) = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()
+        lookups = self.hits + self.semantic_hits + self.misses
+        return {
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.semantic_hits) / lookups if lookups else 0.0,
+            "entries": entries,
+        }
@@ -0,0 +1,140 @@
+import argparse
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Deterministic stand-in for the ollama HTTP API (/api/chat, /api/generate, /api/tags),
+# for exercising llm_outputs without a model. Replies depend only on the request body.
+
+WORDS = ("the model learns parameters by minimizing a cost function over the training data "
+         "using gradient descent with a learning rate chosen by validation").split()
+
+
+def _sample(schema, defs, depth = 0):
+    if "$ref" in schema:
+        return _sample(defs[schema["$ref"].split("/")[-1]], defs, depth)
+    kind = schema.get("type")
+    if kind == "object":
+        return {name: _sample(prop, defs, depth + 1) for name, prop in schema.get("properties", {}).items()}
+    if kind == "array":
+        # recursive schemas (mindmap nodes) stop growing after a few levels
+        count = 2 if depth < 4 else 0
+        return [_sample(schema.get("items", {}), defs, depth + 1) for _ in range(count)]
+    if kind in ("integer", "number"):
+        return 1
+    if kind == "boolean":
+        return True
+    return " ".join(WORDS[depth % len(WORDS):depth % len(WORDS) + 4])
+
+
+def reply_for(body):
+    if isinstance(body.get("format"), dict):
+        schema = body["format"]
+        return json.dumps(_sample(schema, schema.get("$defs", {})))
+    prompt = json.dumps(body.get("messages") or body.get("prompt", ""), sort_keys=True)
+    seed = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest(), 16)
+    length = 20 + seed % 40
+    return " ".join(WORDS[(seed + i) % len(WORDS)] for i in range(length))
+
+
+def _pieces(text):
+    words = text.split(" ")
+    return [word + (" " if i < len(words) - 1 else "") for i, word in enumerate(words)]
+
+
+class StubOllamaHandler(BaseHTTPRequestHandler):
+    token_delay = 0.0
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json({"models": [{"name": "phi3:mini", "model": "phi3:mini"}]})
+        elif self.path == "/api/version":
+            self._send_json({"version": "0.0.0-stub"})
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if self.path not in ("/api/chat", "/api/generate"):
+            self.send_error(404)
+            return
+
+        is_chat = self.path == "/api/chat"
+        text = reply_for(body) if (body.get("messages") or body.get("prompt")) else ""
+        pieces = _pieces(text) if text else []
+        prompt_tokens = len(json.dumps(body.get("messages") or body.get("prompt", ""))) // 4
+        start = time.perf_counter_ns()
+
+        def message(content, done):
+            payload = {"model": body.get("model", "phi3:mini"),
+                       "created_at": datetime.now(timezone.utc).isoformat(), "done": done}
+            if is_chat:
+                payload["message"] = {"role": "assistant", "content": content}
+            else:
+                payload["response"] = content
+            if done:
+                elapsed = time.perf_counter_ns() - start
+                payload.update({"done_reason": "stop", "total_duration": elapsed, "load_duration": 0,
+                                "prompt_eval_count": prompt_tokens, "prompt_eval_duration": elapsed // 10,
+                                "eval_count": len(pieces), "eval_duration": elapsed - elapsed // 10})
+            return payload
+
+        if body.get("stream", True) is False:
+            time.sleep(self.token_delay * len(pieces))
+            self._send_json(message(text, True))
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for piece in pieces:
+            time.sleep(self.token_delay)
+            self._write_chunk(message(piece, False))
+        self._write_chunk(message("", True))
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, payload):
+        data = (json.dumps(payload) + "\n").encode("utf-8")
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+
+def start_stub_server(host = "127.0.0.1", port = 0, token_delay = 0.0):
+    # returns (server, url); the server runs on a daemon thread until server.shutdown()
+    handler = type("Handler", (StubOllamaHandler,), {"token_delay": token_delay})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deterministic stub of the ollama API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--token-delay", type=float, default=0.0, help="seconds to sleep per generated token")
+    args = parser.parse_args()
+
+    server, url = start_stub_server(args.host, args.port, args.token_delay)
+    print(f"Stub ollama listening on {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
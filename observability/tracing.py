@@ -0,0 +1,262 @@
+import contextvars
+import functools
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+# DEEPLEARN_TRACE_FILE=traces.jsonl and/or DEEPLEARN_TRACE_OTEL=1 turn exporters on at import
+TRACE_FILE = os.environ.get("DEEPLEARN_TRACE_FILE")
+TRACE_OTEL = os.environ.get("DEEPLEARN_TRACE_OTEL", "") not in ("", "0")
+IN_MEMORY_MAX_SPANS = 5000
+JSONL_QUEUE_SIZE = 10000
+OTEL_MAX_PENDING_TRACES = 1000
+
+_current = contextvars.ContextVar("deeplearn_span", default=None)
+_exporters = []
+
+
+class Span:
+    # One timed stage. start is wall-clock (for exporters), duration comes from perf_counter.
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start", "duration_ms", "attributes", "error", "_t0")
+
+    def __init__(self, name, parent = None, attributes = None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start = time.time()
+        self.duration_ms = None
+        self.attributes = dict(attributes or {})
+        self.error = None
+        self._t0 = time.perf_counter()
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, error = None):
+        if self.duration_ms is None:
+            self.duration_ms = (time.perf_counter() - self._t0) * 1000
+            if error is not None:
+                self.error = f"{type(error).__name__}: {error}"
+            _export(self)
+
+    def to_dict(self):
+        return {"name": self.name, "trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id,
+                "start": self.start, "duration_ms": self.duration_ms, "attributes": self.attributes, "error": self.error}
+
+
+class _NoopSpan:
+    # handed out while no exporter is installed, so instrumentation costs next to nothing
+    trace_id = None
+    span_id = None
+
+    def set(self, **attributes):
+        pass
+
+    def end(self, error = None):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def enabled():
+    return bool(_exporters)
+
+
+def current_span():
+    return _current.get()
+
+
+def start_span(name, **attributes):
+    # a span that is not made current, for work that outlives the caller's frame (streams);
+    # the caller ends it with span.end()
+    if not _exporters:
+        return NOOP_SPAN
+    return Span(name, _current.get(), attributes)
+
+
+@contextmanager
+def span(name, **attributes):
+    if not _exporters:
+        yield NOOP_SPAN
+        return
+    current = Span(name, _current.get(), attributes)
+    token = _current.set(current)
+    error = None
+    try:
+        yield current
+    except BaseException as exc:
+        error = exc
+        raise
+    finally:
+        try:
+            _current.reset(token)
+        except ValueError:
+            # a generator closed from another context; the span is still recorded
+            pass
+        current.end(error)
+
+
+def record(name, duration_ms, **attributes):
+    # a stage that was timed elsewhere, e.g. inside a worker process
+    if not _exporters:
+        return NOOP_SPAN
+    finished = Span(name, _current.get(), attributes)
+    finished.start -= duration_ms / 1000
+    finished.duration_ms = duration_ms
+    _export(finished)
+    return finished
+
+
+def traced(name = None, **attributes):
+    def decorate(fn):
+        span_name = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _exporters:
+                return fn(*args, **kwargs)
+            with span(span_name, **attributes):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def _export(finished):
+    for exporter in list(_exporters):
+        try:
+            exporter.export(finished)
+        except Exception:
+            # tracing must never break the request it observes
+            pass
+
+
+def add_exporter(exporter):
+    if exporter not in _exporters:
+        _exporters.append(exporter)
+    return exporter
+
+
+def remove_exporter(exporter):
+    if exporter in _exporters:
+        _exporters.remove(exporter)
+    close = getattr(exporter, "close", None)
+    if close:
+        close()
+
+
+class InMemoryExporter:
+    # bounded ring of finished spans, e.g. for the Streamlit debug panel or tests
+    def __init__(self, max_spans = IN_MEMORY_MAX_SPANS):
+        self._spans = deque(maxlen=max_spans)
+        self._lock = threading.Lock()
+
+    def export(self, finished):
+        with self._lock:
+            self._spans.append(finished)
+
+    def spans(self, trace_id = None):
+        with self._lock:
+            spans = list(self._spans)
+        return [s for s in spans if trace_id is None or s.trace_id == trace_id]
+
+    def traces(self, limit = 20):
+        # {trace_id: [spans ordered by start]}, most recent trace last
+        grouped = OrderedDict()
+        for s in self.spans():
+            grouped.setdefault(s.trace_id, []).append(s)
+            grouped.move_to_end(s.trace_id)
+        trace_ids = list(grouped)[-limit:]
+        return OrderedDict((trace_id, sorted(grouped[trace_id], key=lambda s: s.start)) for trace_id in trace_ids)
+
+    def clear(self):
+        with self._lock:
+            self._spans.clear()
+
+
+class JsonlExporter:
+    # one JSON object per span, written by a background thread so the request path never
+    # blocks on file I/O; spans are dropped (and counted) if the writer falls behind
+    def __init__(self, path, queue_size = JSONL_QUEUE_SIZE):
+        self.path = path
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._write, name="trace-writer", daemon=True)
+        self._thread.start()
+
+    def export(self, finished):
+        try:
+            self._queue.put_nowait(finished.to_dict())
+        except queue.Full:
+            self.dropped += 1
+
+    def _write(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                f.write(json.dumps(item, default=str) + "\n")
+                if self._queue.empty():
+                    f.flush()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+
+class OpenTelemetryExporter:
+    # Replays finished traces into an OpenTelemetry tracer. Children finish before their
+    # parents, so a trace is buffered until its root span ends and then emitted top-down.
+    def __init__(self, tracer = None):
+        try:
+            from opentelemetry import trace
+        except ImportError:
+            raise ImportError("OpenTelemetry export needs opentelemetry-api/sdk (pip install opentelemetry-sdk)")
+        self._trace = trace
+        self._tracer = tracer or trace.get_tracer("deeplearn")
+        self._pending = OrderedDict()
+        self._lock = threading.Lock()
+
+    def export(self, finished):
+        with self._lock:
+            self._pending.setdefault(finished.trace_id, []).append(finished)
+            if finished.parent_id is not None:
+                while len(self._pending) > OTEL_MAX_PENDING_TRACES:
+                    self._pending.popitem(last=False)
+                return
+            spans = self._pending.pop(finished.trace_id)
+        children = {}
+        for s in spans:
+            children.setdefault(s.parent_id, []).append(s)
+        self._emit(finished, None, children)
+
+    def _emit(self, finished, parent, children):
+        context = self._trace.set_span_in_context(parent) if parent is not None else None
+        start_ns = int(finished.start * 1e9)
+        otel_span = self._tracer.start_span(finished.name, context=context, start_time=start_ns,
+                                            attributes={key: value if isinstance(value, (bool, int, float, str)) else str(value)
+                                                        for key, value in finished.attributes.items()})
+        if finished.error:
+            otel_span.set_status(self._trace.Status(self._trace.StatusCode.ERROR, finished.error))
+        for child in sorted(children.get(finished.span_id, []), key=lambda s: s.start):
+            self._emit(child, otel_span, children)
+        otel_span.end(end_time=start_ns + int(finished.duration_ms * 1e6))
+
+
+def configure_from_env():
+    if TRACE_FILE:
+        add_exporter(JsonlExporter(TRACE_FILE))
+    if TRACE_OTEL:
+        add_exporter(OpenTelemetryExporter())
+
+
+configure_from_env()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the repo is not installed; make RAG, llm_outputs, ... importable when run as plain `pytest`
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -0,0 +1,40 @@
+import faiss
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from RAG.ann_index import PQ_BITS, make_ann_index, pq_bits
+from RAG.ingest import build_vector_store
+
+
+def chunks(count):
+    return [Document(id=f"doc-{i}", page_content=f"chunk {i} about topic {i % 7}", metadata={"page": i}) for i in range(count)]
+
+
+def test_pq_bits_are_clamped_to_the_corpus():
+    assert pq_bits(0) == PQ_BITS
+    assert pq_bits(1) == 1
+    assert pq_bits(60) == 5
+    assert pq_bits(100000) == PQ_BITS
+
+
+@pytest.mark.parametrize("num_vectors", [2, 10, 60])
+def test_small_ivf_pq_trains(num_vectors):
+    vectors = np.random.default_rng(0).random((num_vectors, 64), dtype=np.float32)
+    index = make_ann_index(64, "ivf_pq", num_vectors)
+    index.train(vectors)
+    index.add(vectors)
+    assert index.ntotal == num_vectors
+
+
+def test_single_vector_ivf_pq_falls_back_to_flat():
+    assert isinstance(make_ann_index(64, "ivf_pq", 1), faiss.IndexFlatL2)
+
+
+@pytest.mark.parametrize("index_type, quantize", [("ivf_pq", None), ("ivf_flat", None), ("flat", "pq")])
+def test_small_corpus_builds(index_type, quantize):
+    embedding_model = DeterministicFakeEmbedding(size=64)
+    vector_store = build_vector_store(embedding_model, chunks(60), index_type=index_type, quantize=quantize)
+    assert vector_store.index.ntotal == 60
+    assert len(vector_store.similarity_search("chunk 3 about topic 3", k=4)) == 4
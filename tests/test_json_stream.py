@@ -0,0 +1,142 @@
+from llm_outputs.json_stream import StructuredStreamParser, parse_structured
+from llm_outputs.mindmap_engine import Branches
+from llm_outputs.model_invoke import Concepts, Quiz, RootNode
+
+
+def feed_in_pieces(parser, text, size = 3):
+    received = []
+    for start in range(0, len(text), size):
+        received += parser.feed(text[start:start + size])
+    return received
+
+
+def test_complete_document():
+    text = '{"concepts": [{"concept": "A", "definition": "first"}, {"concept": "B", "definition": "second"}]}'
+    parser = StructuredStreamParser(Concepts)
+    received = feed_in_pieces(parser, text)
+    assert [item.concept for item in received] == ["A", "B"]
+    assert parser.complete
+    assert parser.close() == Concepts.model_validate_json(text)
+
+
+def test_items_arrive_as_soon_as_they_close():
+    parser = StructuredStreamParser(Concepts)
+    assert parser.feed('{"concepts": [{"concept": "A", "defini') == []
+    assert [item.concept for item in parser.feed('tion": "first"}, {"concept"')] == ["A"]
+
+
+def test_truncated_stream_keeps_finished_items():
+    text = '{"concepts": [{"concept": "A", "definition": "first"}, {"concept": "B", "defin'
+    parser = StructuredStreamParser(Concepts)
+    feed_in_pieces(parser, text)
+    result = parser.close()
+    assert not parser.complete
+    assert [item.concept for item in result.concepts] == ["A"]
+
+
+def test_truncated_before_any_item():
+    assert parse_structured(Concepts, '{"concepts": [{"conc') is None
+    assert parse_structured(Concepts, "") is None
+
+
+def test_malformed_item_is_skipped():
+    text = ('{"concepts": [{"concept": "A", "definition": "first"}, {"concept": "B", "definition": 3}, '
+            '{"concept": "C", "definition": "third"}]}')
+    parser = StructuredStreamParser(Concepts)
+    received = feed_in_pieces(parser, text)
+    assert [item.concept for item in received] == ["A", "C"]
+    assert parser.invalid == 1
+    # the whole document fails validation, so the result is built from the valid items
+    assert not parser.complete
+    assert [item.concept for item in parser.close().concepts] == ["A", "C"]
+
+
+def test_braces_and_quotes_inside_strings():
+    text = ('{"concepts": [{"concept": "set {x}", "definition": "a \\"}]\\" b"}, '
+            '{"concept": "back\\\\", "definition": "{[,:"}]}')
+    parser = StructuredStreamParser(Concepts)
+    received = feed_in_pieces(parser, text, size=1)
+    assert [item.concept for item in received] == ["set {x}", "back\\"]
+    assert received[0].definition == 'a "}]" b'
+    assert parser.complete
+
+
+def test_text_around_the_object_is_ignored():
+    text = 'Sure, here it is:\n```json\n{"concepts": [{"concept": "A", "definition": "first"}]}\n```'
+    result = parse_structured(Concepts, text)
+    assert [item.concept for item in result.concepts] == ["A"]
+
+
+def test_nested_items_and_scalar_fields():
+    text = ('{"root": "R", "description": "root", "children": [{"node": "a", "description": "first", '
+            '"children": [{"node": "a1", "description": "nested", "children": []}]}, {"node": "b", "desc')
+    parser = StructuredStreamParser(RootNode)
+    received = feed_in_pieces(parser, text)
+    # only top-level children are items; the nested node arrives inside its parent
+    assert [item.node for item in received] == ["a"]
+    assert received[0].children[0].node == "a1"
+    result = parser.close()
+    assert result.root == "R"
+    assert [item.node for item in result.children] == ["a"]
+
+
+def test_repeated_items_are_dropped():
+    text = ('{"concepts": [{"concept": "A", "definition": "first"}, {"concept": " a ", "definition": "again"}, '
+            '{"concept": "B", "definition": "second"}]}')
+    parser = StructuredStreamParser(Concepts)
+    assert [item.concept for item in feed_in_pieces(parser, text)] == ["A", "B"]
+
+
+def test_merge_tail():
+    head = StructuredStreamParser(RootNode)
+    head.feed('{"root": "R", "description": "root", "children": [{"node": "a", "description": "first", "children": []}, '
+              '{"node": "b", "chil')
+    head.close()
+    assert head.labels() == ["a"]
+
+    # the tail request repeats the last finished item and supplies the rest
+    tail = StructuredStreamParser(RootNode)
+    tail.feed('{"root": "other", "description": "other", "children": [{"node": "A", "description": "again", "children": []}, '
+              '{"node": "b", "description": "second", "children": []}, {"node": "c", "description": "third", "children": []}]}')
+    tail.close()
+    added = head.merge(tail)
+    assert [item.node for item in added] == ["b", "c"]
+    assert head.complete
+    result = head.result()
+    # fields already received are kept
+    assert (result.root, result.description) == ("R", "root")
+    assert [item.node for item in result.children] == ["a", "b", "c"]
+
+
+def test_merge_truncated_tail():
+    head = StructuredStreamParser(Concepts)
+    head.feed('{"concepts": [{"concept": "A", "definition": "first"}, {"con')
+    tail = StructuredStreamParser(Concepts)
+    tail.feed('{"concepts": [{"concept": "B", "definition": "second"}, {"concept": "C", "defi')
+    assert [item.concept for item in head.merge(tail)] == ["B"]
+    assert not head.complete
+    assert [item.concept for item in head.result().concepts] == ["A", "B"]
+
+
+def test_missing_scalar_field_gives_no_result():
+    # the items are fine, but RootNode cannot be built without its description
+    parser = StructuredStreamParser(RootNode)
+    parser.feed('{"root": "R", "children": [{"node": "a", "description": "first", "children": []}, {"no')
+    assert parser.labels() == ["a"]
+    assert parser.close() is None
+
+
+def test_quiz_items():
+    text = ('{"quiz": [{"question": "What is 1+1?", "answer": "2"}, {"question": "What is {x}?", "answer": "a \\"set\\""}, '
+            '{"question": "Cut')
+    result = parse_structured(Quiz, text)
+    assert [item.question for item in result.quiz] == ["What is 1+1?", "What is {x}?"]
+    assert result.quiz[1].answer == 'a "set"'
+
+
+def test_mindmap_branches():
+    text = ('{"root": "ML", "description": "machine learning", "branches": [{"node": "Supervised", '
+            '"description": "labelled data", "concepts": ["Regression", "Classification"]}, {"node": "Unsup')
+    result = parse_structured(Branches, text)
+    assert result.root == "ML"
+    assert [branch.concepts for branch in result.branches] == [["Regression", "Classification"]]
@@ -0,0 +1,244 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from llm_outputs import ollama_pool
+from llm_outputs.ollama_pool import BATCH, INTERACTIVE, PriorityLimiter
+from llm_outputs.stub_ollama import start_stub_server
+
+MESSAGES = [{"role": "user", "content": "hello"}]
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    # a one-slot limiter in front of the stub server; each reply streams for ~0.1s
+    server, url = start_stub_server(token_delay=0.005)
+    limiter = PriorityLimiter(1)
+    monkeypatch.setattr(ollama_pool, "limiter", limiter)
+    ollama_pool.configure(host=url)
+    yield limiter
+    ollama_pool.configure(host=ollama_pool.OLLAMA_HOST)
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def unreachable(monkeypatch):
+    limiter = PriorityLimiter(1)
+    monkeypatch.setattr(ollama_pool, "limiter", limiter)
+    # nothing listens on the discard port
+    ollama_pool.configure(host="http://127.0.0.1:9")
+    yield limiter
+    ollama_pool.configure(host=ollama_pool.OLLAMA_HOST)
+
+
+def wait_for_queue(limiter, depth, timeout = 5.0):
+    deadline = time.monotonic() + timeout
+    while limiter.metrics()["queue_depth"] != depth:
+        assert time.monotonic() < deadline, f"queue never reached {depth}"
+        time.sleep(0.005)
+
+
+def start_waiter(limiter, priority, name, admitted):
+    def wait():
+        limiter.acquire(priority)
+        admitted.append(name)
+        limiter.release()
+    thread = threading.Thread(target=wait, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_timeout_leaves_the_queue():
+    limiter = PriorityLimiter(1)
+    limiter.acquire()
+    with pytest.raises(TimeoutError):
+        limiter.acquire(timeout=0.05)
+    metrics = limiter.metrics()
+    assert metrics["queue_timeouts"] == 1
+    assert metrics["queue_depth"] == 0
+    limiter.release()
+    assert limiter.acquire(timeout=0.05)
+
+
+def test_interactive_goes_ahead_of_batch():
+    limiter = PriorityLimiter(1)
+    limiter.acquire()
+    admitted = []
+    threads = []
+    for depth, (priority, name) in enumerate([(BATCH, "batch 1"), (BATCH, "batch 2"), (INTERACTIVE, "interactive 1"),
+                                              (INTERACTIVE, "interactive 2")], 1):
+        threads.append(start_waiter(limiter, priority, name, admitted))
+        # queued one at a time so arrival order is fixed
+        wait_for_queue(limiter, depth)
+    limiter.release()
+    for thread in threads:
+        thread.join(5)
+    assert admitted == ["interactive 1", "interactive 2", "batch 1", "batch 2"]
+    assert limiter.metrics()["active"] == 0
+
+
+def test_slot_is_released_on_error():
+    limiter = PriorityLimiter(1)
+    with pytest.raises(RuntimeError):
+        with limiter.slot():
+            raise RuntimeError("request failed")
+    assert limiter.metrics()["active"] == 0
+
+
+def test_abandoned_waiter_leaves_without_a_slot():
+    limiter = PriorityLimiter(1)
+    limiter.acquire()
+    abandoned = threading.Event()
+    results = []
+    thread = threading.Thread(target=lambda: results.append(limiter.acquire(abandoned=abandoned)), daemon=True)
+    thread.start()
+    wait_for_queue(limiter, 1)
+    limiter.abandon(abandoned)
+    thread.join(5)
+    assert results == [False]
+    assert limiter.metrics()["queue_depth"] == 0
+    assert limiter.metrics()["active"] == 1
+
+
+def test_cancelled_async_waiter_does_not_keep_a_slot(monkeypatch):
+    limiter = PriorityLimiter(1)
+    monkeypatch.setattr(ollama_pool, "limiter", limiter)
+    limiter.acquire()
+
+    async def cancelled_wait():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(ollama_pool._aacquire(INTERACTIVE, None), 0.05)
+
+    asyncio.run(cancelled_wait())
+    wait_for_queue(limiter, 0)
+    limiter.release()
+    assert limiter.metrics()["active"] == 0
+    assert limiter.acquire(timeout=1)
+
+
+def test_async_waiter_gets_a_freed_slot(monkeypatch):
+    limiter = PriorityLimiter(1)
+    monkeypatch.setattr(ollama_pool, "limiter", limiter)
+    limiter.acquire()
+
+    async def wait():
+        asyncio.get_running_loop().call_later(0.05, limiter.release)
+        await ollama_pool._aacquire(INTERACTIVE, 5)
+
+    asyncio.run(wait())
+    assert limiter.metrics()["active"] == 1
+
+
+def test_async_queue_timeout(monkeypatch):
+    limiter = PriorityLimiter(1)
+    monkeypatch.setattr(ollama_pool, "limiter", limiter)
+    limiter.acquire()
+    with pytest.raises(TimeoutError):
+        asyncio.run(ollama_pool._aacquire(INTERACTIVE, 0.05))
+    assert limiter.metrics()["queue_timeouts"] == 1
+    assert limiter.metrics()["active"] == 1
+
+
+def test_priority_floor():
+    assert ollama_pool._effective_priority(INTERACTIVE) == INTERACTIVE
+    with ollama_pool.priority_floor(BATCH):
+        assert ollama_pool._effective_priority(INTERACTIVE) == BATCH
+    assert ollama_pool._effective_priority(INTERACTIVE) == INTERACTIVE
+
+
+def test_p95_uses_nearest_rank():
+    limiter = PriorityLimiter(1)
+    limiter._waits[INTERACTIVE].extend([0.1, 0.2])
+    assert limiter.metrics()["wait"]["interactive"]["p95_s"] == 0.2
+    limiter._waits[BATCH].extend(i / 100 for i in range(1, 101))
+    assert limiter.metrics()["wait"]["batch"]["p95_s"] == 0.95
+
+
+def test_scheduled_chat_serves_interactive_first(stub):
+    stub.acquire()
+    finished = []
+
+    def chat(priority, name):
+        response = ollama_pool.scheduled_chat(priority, model="phi3:mini", messages=MESSAGES)
+        assert response.message.content
+        finished.append(name)
+
+    threads = []
+    for depth, (priority, name) in enumerate([(BATCH, "batch"), (INTERACTIVE, "interactive")], 1):
+        threads.append(threading.Thread(target=chat, args=(priority, name), daemon=True))
+        threads[-1].start()
+        wait_for_queue(stub, depth)
+    stub.release()
+    for thread in threads:
+        thread.join(10)
+    assert finished == ["interactive", "batch"]
+    assert stub.metrics()["active"] == 0
+
+
+def test_scheduled_chat_releases_on_error(unreachable):
+    with pytest.raises(ConnectionError):
+        ollama_pool.scheduled_chat(model="phi3:mini", messages=MESSAGES)
+    assert unreachable.metrics()["active"] == 0
+
+
+def test_abandoned_stream_releases_its_slot(stub):
+    stream = ollama_pool.scheduled_chat_stream(model="phi3:mini", messages=MESSAGES)
+    assert next(stream).message.content
+    assert stub.metrics()["active"] == 1
+    stream.close()
+    assert stub.metrics()["active"] == 0
+
+
+def test_ascheduled_chat(stub):
+    async def chat():
+        return await ollama_pool.ascheduled_chat(model="phi3:mini", messages=MESSAGES)
+
+    assert asyncio.run(chat()).message.content
+    assert stub.metrics()["active"] == 0
+
+
+def test_ascheduled_chat_serves_interactive_first(stub):
+    stub.acquire()
+
+    async def chat(priority, name, finished):
+        await ollama_pool.ascheduled_chat(priority, model="phi3:mini", messages=MESSAGES)
+        finished.append(name)
+
+    async def run():
+        finished = []
+        batch = asyncio.create_task(chat(BATCH, "batch", finished))
+        await asyncio.get_running_loop().run_in_executor(None, wait_for_queue, stub, 1)
+        interactive = asyncio.create_task(chat(INTERACTIVE, "interactive", finished))
+        await asyncio.get_running_loop().run_in_executor(None, wait_for_queue, stub, 2)
+        stub.release()
+        await asyncio.gather(batch, interactive)
+        return finished
+
+    assert asyncio.run(run()) == ["interactive", "batch"]
+    assert stub.metrics()["active"] == 0
+
+
+def test_ascheduled_chat_releases_on_error(unreachable):
+    async def chat():
+        await ollama_pool.ascheduled_chat(model="phi3:mini", messages=MESSAGES)
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(chat())
+    assert unreachable.metrics()["active"] == 0
+
+
+def test_abandoned_async_stream_releases_its_slot(stub):
+    async def read_one():
+        stream = ollama_pool.ascheduled_chat_stream(model="phi3:mini", messages=MESSAGES)
+        part = await stream.__anext__()
+        active = stub.metrics()["active"]
+        await stream.aclose()
+        return part, active
+
+    part, active = asyncio.run(read_one())
+    assert part.message.content
+    assert active == 1
+    assert stub.metrics()["active"] == 0